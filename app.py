@@ -1,33 +1,123 @@
 import discord
 from discord.ext import commands
+from discord import app_commands
 import os
 import re
 import asyncio
-from flask import Flask
-from threading import Thread
 from datetime import datetime, timedelta
 import json
+import time
+import base64
+import sys
+from array import array
+import hashlib
+import heapq
+import itertools
 import aiohttp
-
-# --- Flask Web Server (用于保活) ---
-# 创建一个 Flask 应用实例
-app = Flask('')
-
-# 定义一个路由，这是保活网站要访问的地址
-@app.route('/')
-def home():
-    return "I'm alive!"
-
-# 定义一个函数来运行 Flask 服务器
-def run_flask():
-    # Render 会通过 PORT 环境变量告诉我们用哪个端口
-    port = int(os.environ.get('PORT', 10000))
-    app.run(host='0.0.0.0', port=port)
+from aiohttp import web
+from collections import deque
+from contextlib import contextmanager
+from bisect import bisect_left
+import functools
+import logging
+import signal
+import threading
+import traceback
+from urllib.parse import quote
+
+# --- 保活 Web 服务 ---
+# 默认由 aiohttp 在机器人自己的事件循环中提供服务（见下方 start_web_server）；
+# 设置 KEEPALIVE_SERVER=flask 时才导入 Flask，沿用单独线程运行的 Flask 服务器
+KEEPALIVE_SERVER = os.getenv("KEEPALIVE_SERVER", "aiohttp").lower()
+# Render 会通过 PORT 环境变量告诉我们用哪个端口
+WEB_PORT = int(os.environ.get('PORT', 10000))
+
+if KEEPALIVE_SERVER == "flask":
+    from flask import Flask, Response
+    from threading import Thread
+
+    # 创建一个 Flask 应用实例
+    app = Flask('')
+
+    # 定义一个路由，这是保活网站要访问的地址
+    @app.route('/')
+    def home():
+        return "I'm alive!"
+
+    # 健康检查与运行指标，内容由机器人事件循环定期生成
+    @app.route('/healthz')
+    def healthz():
+        return Response(health_text, status=200 if health_ok else 503, mimetype="application/json")
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(metrics_text, mimetype="text/plain; version=0.0.4")
+
+    # 定义一个函数来运行 Flask 服务器
+    def run_flask():
+        app.run(host='0.0.0.0', port=WEB_PORT)
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+
+class DuiduiBot(commands.Bot):
+    async def setup_hook(self):
+        # 创建远程存储共用的 HTTP 会话，启动后台写回任务
+        get_http_session()
+        for saver in (vote_saver, ticket_index_saver, member_check_saver):
+            saver.start()
+        member_check_scheduler.start()
+        log_sink.start()
+        # 统计 REST 调用次数和 429
+        install_rest_counter(self.http)
+        install_webhook_counter()
+        rate_limit_handler = RateLimitLogHandler(logging.WARNING)
+        logging.getLogger("discord.http").addHandler(rate_limit_handler)
+        logging.getLogger("discord.webhook.async_").addHandler(rate_limit_handler)
+        loop_lag.start()
+        if KEEPALIVE_SERVER == "flask":
+            # Flask 线程不能直接访问事件循环中的对象，定期发布指标文本
+            self.metrics_task = asyncio.create_task(publish_metrics_loop())
+        else:
+            self.web_runner = await start_web_server()
+        # 投票按钮按 custom_id 模板统一处理，重启前创建的投票也能直接点击
+        self.add_dynamic_items(VoteButton)
+        # Docker / Render 停止容器时发送 SIGTERM，需要走 close() 才能写入未保存的修改
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._on_sigterm)
+        except (NotImplementedError, RuntimeError):
+            # Windows 不支持，或不在主线程中运行
+            pass
+
+    def _on_sigterm(self):
+        if getattr(self, "shutdown_task", None) is None:
+            print("收到 SIGTERM，保存数据后退出...")
+            self.shutdown_task = asyncio.create_task(self.close())
+
+    async def close(self):
+        await member_check_scheduler.stop()
+        await kick_sweeper.stop()
+        # 关闭前确保所有未写入的修改落盘
+        for saver in (vote_saver, ticket_index_saver, member_check_saver):
+            try:
+                await saver.stop()
+            except Exception as e:
+                print(f"关闭时写入 {saver.name} 失败: {e}")
+        await log_sink.stop()
+        print(f"日志写入统计: {log_sink.stats()}")
+        event_recorder.close()
+        await close_http_session()
+        loop_lag.stop()
+        if getattr(self, "web_runner", None) is not None:
+            await self.web_runner.cleanup()
+        for name, stats in backend_stats.items():
+            print(f"存储调用统计 {name}: {stats.summary()}")
+        await super().close()
+
+
+bot = DuiduiBot(command_prefix="!", intents=intents)
 
 STAFF_ROLE_NAME = "管理" 
 VERIFIED_ROLE_NAME = "已审核"
@@ -47,17 +137,241 @@ VERIFY_KEYWORDS_PATTERN = re.compile(
     r"已审核|审核通过|审核已通过|审核结束|结束审核|通过审核|审核已结束|完成审核|审核已完成|审核过了"
 )
 
+# --- 身份组与配置索引 ---
+# 每个服务器按名称索引身份组，并缓存配置中的频道/分类，
+# 由身份组与频道事件维护，权限检查不再每次线性扫描 guild.roles
+class GuildIndex:
+    def __init__(self):
+        self._roles = {}  # 服务器ID -> {身份组名称: 身份组}
+        self._channels = {}  # 频道ID -> 频道对象
+        self.stats = {"role_hits": 0, "role_misses": 0, "channel_hits": 0, "channel_misses": 0, "rebuilds": 0}
+
+    def rebuild_roles(self, guild):
+        names = {}
+        # 重名时保留位置最低的身份组，与 discord.utils.get(guild.roles, name=...) 结果一致
+        for role in guild.roles:
+            names.setdefault(role.name, role)
+        self._roles[guild.id] = names
+        self.stats["rebuilds"] += 1
+        return names
+
+    def forget_guild(self, guild_id):
+        self._roles.pop(guild_id, None)
+
+    def role(self, guild, name):
+        """按名称查找身份组，找不到返回 None"""
+        names = self._roles.get(guild.id)
+        if names is None:
+            self.stats["role_misses"] += 1
+            names = self.rebuild_roles(guild)
+        else:
+            self.stats["role_hits"] += 1
+        return names.get(name)
+
+    def has_role(self, member, name):
+        role = self.role(member.guild, name)
+        return role is not None and member.get_role(role.id) is not None
+
+    def channel(self, channel_id, guild=None):
+        """查找配置中的频道或分类，找不到返回 None"""
+        channel = self._channels.get(channel_id)
+        if channel is not None:
+            self.stats["channel_hits"] += 1
+            return channel
+        self.stats["channel_misses"] += 1
+        channel = guild.get_channel(channel_id) if guild is not None else bot.get_channel(channel_id)
+        if channel is not None:
+            self._channels[channel_id] = channel
+        return channel
+
+    def forget_channel(self, channel_id):
+        self._channels.pop(channel_id, None)
+
+
+guild_index = GuildIndex()
+
+def is_staff(member):
+    return guild_index.has_role(member, STAFF_ROLE_NAME)
+
+def get_log_channel():
+    return guild_index.channel(LOG_CHANNEL_ID)
+
+# --- 日志频道批量写入 ---
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))  # 最长等待多久发送一批日志（秒）
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "500"))  # 队列最多保留多少条，超出的丢弃并计数
+DISCORD_MESSAGE_LIMIT = 2000  # Discord 单条消息字数上限
+LOG_MESSAGE_LIMIT = DISCORD_MESSAGE_LIMIT
+
+
+class LogSink:
+    """日志频道的异步写入队列
+
+    write() 只把日志放入队列，不等待网络请求；后台任务每隔 interval 秒，
+    或队列内容足够拼满一条消息时，把多行日志合并成尽量少的消息发送。
+    队列满时丢弃新日志并计数，下一批开头会注明丢弃条数；日志频道不可用或发送失败时输出到标准输出。
+    """
+
+    def __init__(self, interval=LOG_FLUSH_INTERVAL, max_queue=LOG_QUEUE_MAX):
+        self.interval = interval
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._queued_chars = 0
+        self._dropped = 0
+        self._wakeup = None
+        self._task = None
+        self._closing = False
+        self.lines = 0
+        self.messages = 0
+        self.dropped_total = 0
+        self.fallback_lines = 0
+
+    def write(self, text):
+        text = str(text)
+        if len(text) > LOG_MESSAGE_LIMIT:
+            text = text[:LOG_MESSAGE_LIMIT - 1] + "…"
+        if len(self._queue) >= self.max_queue:
+            self._dropped += 1
+            self.dropped_total += 1
+            return
+        self._queue.append(text)
+        self._queued_chars += len(text) + 1
+        self.lines += 1
+        if self._wakeup is not None and self._queued_chars >= LOG_MESSAGE_LIMIT:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _take_batch(self):
+        """取出不超过一条消息长度的若干行"""
+        lines = []
+        size = 0
+        if self._dropped:
+            notice = f"⚠️ 日志过多，已丢弃 {self._dropped} 条"
+            self._dropped = 0
+            lines.append(notice)
+            size = len(notice) + 1
+        while self._queue and size + len(self._queue[0]) <= LOG_MESSAGE_LIMIT:
+            text = self._queue.popleft()
+            self._queued_chars -= len(text) + 1
+            lines.append(text)
+            size += len(text) + 1
+        return lines
+
+    async def flush(self):
+        """发送队列中的全部日志"""
+        while self._queue or self._dropped:
+            lines = self._take_batch()
+            log_channel = get_log_channel()
+            if log_channel is None:
+                self._fallback(lines)
+                continue
+            try:
+                await log_channel.send("\n".join(lines))
+                self.messages += 1
+            except Exception as e:
+                print(f"发送日志失败: {e}")
+                self._fallback(lines)
+
+    def _fallback(self, lines):
+        self.fallback_lines += len(lines)
+        for text in lines:
+            print(f"[日志] {text}")
+
+    async def stop(self):
+        """停止后台任务并发送剩余日志"""
+        if self._task is not None:
+            # 不取消任务，让正在发送的一批完成，避免日志丢失或重复
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "queued": len(self._queue),
+            "lines": self.lines,
+            "messages": self.messages,
+            "dropped": self.dropped_total,
+            "fallback_lines": self.fallback_lines,
+        }
+
+
+log_sink = LogSink()
+
+# --- 工单开票人缓存 ---
+# 频道ID -> 开票人ID。开票人是工单开头第一条带 @ 的机器人消息中被 @ 的用户，
+# 首次查找时从频道历史中识别，之后直接读取缓存
+_ticket_owner_cache = {}
+# 机器人运行期间新建的工单频道：其中第一条带 @ 的机器人消息即为开票提示，可直接写入缓存
+_fresh_ticket_channels = set()
+ticket_owner_stats = {"hits": 0, "misses": 0}
+
+async def get_ticket_owner_id(channel):
+    """返回工单频道开票人的用户ID，无法识别时返回 None"""
+    owner_id = _ticket_owner_cache.get(channel.id)
+    if owner_id is not None:
+        ticket_owner_stats["hits"] += 1
+        return owner_id
+
+    ticket_owner_stats["misses"] += 1
+    async for old_message in channel.history(limit=10, oldest_first=True):
+        if old_message.author.bot and old_message.mentions:
+            owner_id = old_message.mentions[0].id
+            _ticket_owner_cache[channel.id] = owner_id
+            _fresh_ticket_channels.discard(channel.id)
+            if channel.name.startswith(TICKET_CHANNEL_PREFIX):
+                ticket_activity.set_owner(channel.guild.id, channel.id, owner_id)
+            return owner_id
+    return None
+
+async def get_ticket_owner(channel):
+    """返回工单频道开票人的成员对象，无法识别或已离开服务器时返回 None"""
+    owner_id = await get_ticket_owner_id(channel)
+    if owner_id is None:
+        return None
+    member = channel.guild.get_member(owner_id)
+    if member is None:
+        try:
+            member = await channel.guild.fetch_member(owner_id)
+        except (discord.NotFound, discord.HTTPException):
+            return None
+    return member
+
+def remember_ticket_owner(message):
+    """从新工单中的机器人开票提示直接记录开票人"""
+    channel_id = message.channel.id
+    if channel_id in _fresh_ticket_channels and message.mentions:
+        owner_id = message.mentions[0].id
+        _ticket_owner_cache[channel_id] = owner_id
+        _fresh_ticket_channels.discard(channel_id)
+        ticket_activity.set_owner(message.guild.id, channel_id, owner_id)
+
+def forget_ticket_channel(channel_id):
+    _ticket_owner_cache.pop(channel_id, None)
+    _fresh_ticket_channels.discard(channel_id)
+    ticket_activity.remove_channel(channel_id)
+
 class DeleteTicketView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)
 
     @discord.ui.button(label="删除该频道", style=discord.ButtonStyle.secondary, custom_id="delete_ticket_confirm")
     async def delete_button_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
-        ticket_creator = None
-        async for old_message in interaction.channel.history(limit=10, oldest_first=True):
-            if old_message.author.bot and old_message.mentions:
-                ticket_creator = old_message.mentions[0]
-                break
+        ticket_creator = await get_ticket_owner(interaction.channel)
 
         if ticket_creator:
             final_message = f"🎉恭喜{ticket_creator.mention}已通过审核，请阅读并遵守吃饭须知，此频道即将被删除"
@@ -75,8 +389,7 @@ class DeleteSuggestionView(discord.ui.View):
     @discord.ui.button(label="删除此频道", style=discord.ButtonStyle.danger, custom_id="delete_suggestion_confirm")
     async def delete_suggestion_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         # 检查权限
-        staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
-        if not staff_role or staff_role not in interaction.user.roles:
+        if not is_staff(interaction.user):
             await interaction.response.send_message("❌ 权限不足：只有管理组可以删除建议频道！", ephemeral=True)
             return
         
@@ -88,22 +401,731 @@ class DeleteSuggestionView(discord.ui.View):
 # 存储活跃的投票
 active_votes = {}
 vote_tasks = {}
+
+class VoterStore:
+    """紧凑的投票者存储
+
+    用户ID、选项序号、投票时间（时间戳）分别保存在 array 中，名称字符串经过驻留，
+    比每个投票者一个 {"option", "user", "time"} 字典节省大量内存。
+    to_json()/from_json() 与原来的 {用户ID字符串: {"option", "user", "time"}} 格式互转，
+    存储格式保持不变。
+    """
+
+    __slots__ = ("_ids", "_options", "_times", "_names", "_members")
+
+    def __init__(self):
+        self._ids = array('q')
+        self._options = array('B')
+        self._times = array('d')
+        self._names = []
+        self._members = set()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, user_id):
+        return int(user_id) in self._members
+
+    def add(self, user_id, option_index, user_name, timestamp):
+        user_id = int(user_id)
+        if user_id in self._members:
+            return False
+        self._members.add(user_id)
+        self._ids.append(user_id)
+        self._options.append(option_index)
+        self._times.append(timestamp)
+        self._names.append(sys.intern(user_name))
+        return True
+
+    def items(self):
+        """按投票顺序返回 (用户ID字符串, 投票信息字典)，格式与原字典一致"""
+        for user_id, option_index, name, ts in zip(self._ids, self._options, self._names, self._times):
+            yield str(user_id), {
+                "option": option_index,
+                "user": name,
+                "time": datetime.fromtimestamp(ts).isoformat() if ts == ts else ""
+            }
+
+    def values(self):
+        for _, vote_info in self.items():
+            yield vote_info
+
+    def to_json(self):
+        return dict(self.items())
+
+    @classmethod
+    def from_json(cls, voters):
+        store = cls()
+        for user_id, vote_info in voters.items():
+            try:
+                ts = datetime.fromisoformat(vote_info.get("time", "")).timestamp()
+            except ValueError:
+                ts = float("nan")
+            store.add(user_id, vote_info["option"], vote_info.get("user", ""), ts)
+        return store
+
+
+def use_compact_voters(votes):
+    """把加载得到的投票数据中的投票者字典转换为 VoterStore"""
+    for vote_data in votes.values():
+        if not isinstance(vote_data["voters"], VoterStore):
+            vote_data["voters"] = VoterStore.from_json(vote_data["voters"])
+    return votes
+
+def _json_default(obj):
+    """json.dumps 的 default：把 VoterStore 输出为原格式"""
+    if isinstance(obj, VoterStore):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# 每个投票每个选项最近的投票者（仅内存），/投票状态 直接读取，不再对全部投票者分组排序
+RECENT_VOTERS_PER_OPTION = 10
+_recent_voters = {}  # 投票ID -> [deque(投票者名称), ...]，下标为选项序号
+
+def recent_voter_buffers(vote_id, vote_data):
+    """返回投票各选项的最近投票者，首次访问时从投票记录重建"""
+    buffers = _recent_voters.get(vote_id)
+    if buffers is None:
+        buffers = [deque(maxlen=RECENT_VOTERS_PER_OPTION) for _ in vote_data["options"]]
+        # 投票记录按投票先后顺序保存，顺序追加即可
+        for vote_info in vote_data["voters"].values():
+            buffers[vote_info["option"]].append(vote_info["user"])
+        _recent_voters[vote_id] = buffers
+    return buffers
+
+# --- 投票编号索引 ---
+class VoteRegistry:
+    """每个服务器的 短编号 -> 投票ID 索引
+
+    短编号是服务器内递增的数字，创建投票时分配并保存在投票数据的 short_id 字段中。
+    """
+
+    def __init__(self):
+        self._by_guild = {}  # 服务器ID -> {短编号: 投票ID}
+        self._counters = {}  # 服务器ID -> 已分配的最大编号
+
+    def register(self, vote_id, vote_data):
+        """登记投票，没有短编号（旧数据）时分配一个，返回是否新分配了编号"""
+        guild_id = vote_data["guild_id"]
+        votes = self._by_guild.setdefault(guild_id, {})
+        short_id = vote_data.get("short_id")
+        assigned = False
+        if not short_id or votes.get(short_id, vote_id) != vote_id:
+            short_id = str(self._counters.get(guild_id, 0) + 1)
+            vote_data["short_id"] = short_id
+            assigned = True
+        if short_id.isdigit():
+            self._counters[guild_id] = max(self._counters.get(guild_id, 0), int(short_id))
+        votes[short_id] = vote_id
+        return assigned
+
+    def unregister(self, vote_id, vote_data):
+        votes = self._by_guild.get(vote_data["guild_id"])
+        if votes and votes.get(vote_data.get("short_id")) == vote_id:
+            del votes[vote_data["short_id"]]
+
+    def votes_in(self, guild_id):
+        """返回服务器内的 {短编号: 投票ID}"""
+        return self._by_guild.get(guild_id, {})
+
+    def resolve(self, guild_id, text):
+        """根据输入的编号查找投票ID，找不到或不唯一时返回 None"""
+        text = text.strip().lstrip('#')
+        votes = self.votes_in(guild_id)
+        vote_id = votes.get(text)
+        if vote_id is not None:
+            return vote_id
+        # 兼容旧的"投票ID后缀"输入，仅在唯一匹配时使用
+        matches = [vid for vid in votes.values() if vid.endswith(text)]
+        return matches[0] if text and len(matches) == 1 else None
+
+
+vote_registry = VoteRegistry()
+
+def record_recent_voter(vote_id, option_index, user_name):
+    buffers = _recent_voters.get(vote_id)
+    # 尚未建立时不需要处理，首次访问时会从投票记录重建
+    if buffers is not None:
+        buffers[option_index].append(user_name)
 # 存储配置 - 可选择不同的存储方式
-STORAGE_TYPE = os.getenv("STORAGE_TYPE", "file")  # file, cloudflare_kv, github
+STORAGE_TYPE = os.getenv("STORAGE_TYPE", "file")  # file, journal, cloudflare_kv, github
 VOTES_DATA_FILE = "votes_data.json"
 
+# 日志存储配置（journal 模式）：每次修改追加到日志，后台定期整理成快照
+VOTES_JOURNAL_FILE = "votes_journal.jsonl"
+JOURNAL_COMPACT_RECORDS = int(os.getenv("JOURNAL_COMPACT_RECORDS", "5000"))  # 日志累积多少条后整理
+JOURNAL_COMPACT_INTERVAL = float(os.getenv("JOURNAL_COMPACT_INTERVAL", "600"))  # 最长整理间隔（秒）
+
 # Cloudflare KV 配置
 CLOUDFLARE_ACCOUNT_ID = os.getenv("CLOUDFLARE_ACCOUNT_ID")
 CLOUDFLARE_NAMESPACE_ID = os.getenv("CLOUDFLARE_NAMESPACE_ID") 
 CLOUDFLARE_API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
+CLOUDFLARE_API_BASE = os.getenv("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4").rstrip("/")
+# KV 布局：每个投票一个键，外加一个记录活跃投票ID的索引键
+KV_INDEX_KEY = "votes_index"
+KV_VOTE_KEY_PREFIX = "vote:"
+KV_LEGACY_KEY = "votes_data"  # 旧版整体存储的键，仅在索引不存在时读取
+KV_LOAD_CONCURRENCY = int(os.getenv("KV_LOAD_CONCURRENCY", "8"))  # 加载时并发请求数
 
 # GitHub 存储配置
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 GITHUB_REPO = os.getenv("GITHUB_REPO")  # 格式: username/repo
 GITHUB_FILE_PATH = "votes_data.json"
+GITHUB_API_BASE = os.getenv("GITHUB_API_BASE", "https://api.github.com").rstrip("/")
+# 批量提交窗口（秒）：大于 0 时每个窗口内最多提交一次，0 表示按普通写回间隔提交
+GITHUB_COMMIT_WINDOW = float(os.getenv("GITHUB_COMMIT_WINDOW", "0"))
+# 附加状态（工单索引、成员检查计划、命令同步记录）提交到单独的分支，不进入投票数据所在分支的历史；
+# 分支不存在时从默认分支创建，设为空字符串则与投票数据提交到同一分支
+GITHUB_AUX_BRANCH = os.getenv("GITHUB_AUX_BRANCH", "bot-state")
+# 附加状态每个文件各自提交，两次提交之间的最短间隔（秒）
+GITHUB_AUX_COMMIT_INTERVAL = float(os.getenv("GITHUB_AUX_COMMIT_INTERVAL", "600"))
+
+# --- 远程存储共用的 HTTP 会话 ---
+# 所有远程存储请求复用同一个连接池，避免每次保存都重新建立 TCP + TLS 连接
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "20"))  # 最大并发连接数
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "15"))  # 单次请求超时
+_http_session = None
+
+def get_http_session():
+    """获取共用的 aiohttp 会话（首次调用时创建）"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS, connect=5)
+        )
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+class LatencyStats:
+    """单个调用的耗时统计"""
+
+    def __init__(self, samples=200):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=samples)
+
+    def observe(self, seconds, ok=True):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else 0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 1),
+            "p95_ms": round(self.percentile(0.95) * 1000, 1),
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+
+# 各存储调用的耗时，例如 "cloudflare_kv.save"、"github.put"、"file.save"、"journal.append"
+backend_stats = {}
+
+@contextmanager
+def timed_backend_call(name):
+    stats = backend_stats.setdefault(name, LatencyStats())
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        stats.observe(time.perf_counter() - start, ok)
+
+# --- 运行指标（/metrics） ---
+# 计数器只在事件循环中修改；后台任务定期把指标渲染成文本，Web 服务线程只读取这个字符串，不需要加锁
+METRICS_REFRESH_INTERVAL = float(os.getenv("METRICS_REFRESH_INTERVAL", "5"))
+HANDLER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """固定分桶的耗时直方图"""
+
+    def __init__(self, buckets=HANDLER_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+
+    def observe(self, seconds, ok=True):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if not ok:
+            self.errors += 1
+
+
+handler_latency = {}  # 处理函数名 -> Histogram
+rest_calls = {}  # (方法, 路由) -> 次数
+rest_rate_limits = {"route": 0, "global": 0, "webhook": 0}
+metrics_text = ""
+
+@contextmanager
+def handler_timer(name):
+    hist = handler_latency.get(name)
+    if hist is None:
+        hist = handler_latency[name] = Histogram()
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        elapsed = time.perf_counter() - start
+        hist.observe(elapsed, ok)
+        if elapsed >= SLOW_HANDLER_THRESHOLD:
+            slow_calls.record("handler", name, elapsed)
+
+def timed_handler(name):
+    """记录 async 处理函数（斜杠命令、事件分支）耗时的装饰器"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with handler_timer(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def install_rest_counter(http):
+    """包装 discord.py 的 HTTPClient.request，按方法和路由统计 REST 调用次数"""
+    original = http.request
+
+    async def request(route, **kwargs):
+        key = (route.method, route.path)
+        rest_calls[key] = rest_calls.get(key, 0) + 1
+        return await original(route, **kwargs)
+
+    http.request = request
+
+def install_webhook_counter():
+    """交互响应和 followup 不经过 HTTPClient，而是由 webhook 适配器发送，同样按路由统计"""
+    from discord.webhook.async_ import AsyncWebhookAdapter
+    original = AsyncWebhookAdapter.request
+    if getattr(original, "_counted", False):
+        return
 
-async def save_votes_data():
-    """保存投票数据"""
+    async def request(self, route, session, **kwargs):
+        key = (route.method, route.path)
+        rest_calls[key] = rest_calls.get(key, 0) + 1
+        try:
+            return await original(self, route, session, **kwargs)
+        except discord.HTTPException as e:
+            # 不经过代理的 429（Cloudflare 限制）直接抛出，不会写日志
+            if e.status == 429:
+                rest_rate_limits["webhook"] += 1
+            raise
+
+    request._counted = True
+    AsyncWebhookAdapter.request = request
+
+
+class RateLimitLogHandler(logging.Handler):
+    """从 discord.http 和 webhook 适配器的警告日志中统计 429 次数"""
+
+    def emit(self, record):
+        msg = str(record.msg)
+        if msg.startswith("We are being rate limited"):
+            rest_rate_limits["route"] += 1
+        elif msg.startswith("Global rate limit"):
+            rest_rate_limits["global"] += 1
+        elif msg.startswith("Webhook ID"):
+            rest_rate_limits["webhook"] += 1
+
+
+def _metric_labels(**labels):
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def render_metrics():
+    """按 Prometheus 文本格式输出当前指标"""
+    lines = [
+        "# HELP duidui_handler_seconds 处理函数耗时",
+        "# TYPE duidui_handler_seconds histogram",
+    ]
+    for name, hist in sorted(handler_latency.items()):
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(f"duidui_handler_seconds_bucket{_metric_labels(handler=name, le=bound)} {cumulative}")
+        lines.append(f"duidui_handler_seconds_bucket{_metric_labels(handler=name, le='+Inf')} {hist.count}")
+        lines.append(f"duidui_handler_seconds_sum{_metric_labels(handler=name)} {hist.total:.6f}")
+        lines.append(f"duidui_handler_seconds_count{_metric_labels(handler=name)} {hist.count}")
+    lines.append("# TYPE duidui_handler_errors_total counter")
+    for name, hist in sorted(handler_latency.items()):
+        lines.append(f"duidui_handler_errors_total{_metric_labels(handler=name)} {hist.errors}")
+
+    lines.append("# HELP duidui_rest_requests_total Discord REST 调用次数（含交互响应和 followup）")
+    lines.append("# TYPE duidui_rest_requests_total counter")
+    for (method, path), count in sorted(rest_calls.items()):
+        lines.append(f"duidui_rest_requests_total{_metric_labels(method=method, route=path)} {count}")
+    lines.append("# TYPE duidui_rest_rate_limited_total counter")
+    for scope, count in rest_rate_limits.items():
+        lines.append(f"duidui_rest_rate_limited_total{_metric_labels(scope=scope)} {count}")
+
+    # 未连接网关时 bot.latency 为 nan，不输出
+    if bot.latency == bot.latency:
+        lines.append("# TYPE duidui_gateway_latency_seconds gauge")
+        lines.append(f"duidui_gateway_latency_seconds {bot.latency:.6f}")
+    lines.append("# TYPE duidui_event_loop_lag_seconds gauge")
+    lines.append(f"duidui_event_loop_lag_seconds {loop_lag.last:.6f}")
+    lines.append("# TYPE duidui_slow_calls_total counter")
+    for kind, count in sorted(slow_calls.counts.items()):
+        lines.append(f"duidui_slow_calls_total{_metric_labels(kind=kind)} {count}")
+    lines.append("# TYPE duidui_active_votes gauge")
+    lines.append(f"duidui_active_votes {len(active_votes)}")
+    lines.append("# TYPE duidui_voters gauge")
+    lines.append(f"duidui_voters {sum(len(v['voters']) for v in active_votes.values())}")
+    lines.append("# TYPE duidui_member_checks_pending gauge")
+    lines.append(f"duidui_member_checks_pending {len(member_check_scheduler)}")
+    next_check = member_check_scheduler.next_deadline()
+    if next_check is not None:
+        lines.append("# HELP duidui_member_check_next_seconds 距离下一个成员检查到期的秒数")
+        lines.append("# TYPE duidui_member_check_next_seconds gauge")
+        lines.append(f"duidui_member_check_next_seconds {next_check - time.time():.1f}")
+    lines.append("# TYPE duidui_sweep_queue_depth gauge")
+    lines.append(f"duidui_sweep_queue_depth {kick_sweeper.queue_depth()}")
+    lines.append("# HELP duidui_guild_index_lookups_total 身份组/配置频道索引查找（miss 需要重建或从缓存外读取）")
+    lines.append("# TYPE duidui_guild_index_lookups_total counter")
+    for kind in ("role", "channel"):
+        for result, key in (("hit", "hits"), ("miss", "misses")):
+            count = guild_index.stats[f"{kind}_{key}"]
+            lines.append(f"duidui_guild_index_lookups_total{_metric_labels(kind=kind, result=result)} {count}")
+    lines.append("# TYPE duidui_guild_index_rebuilds_total counter")
+    lines.append(f"duidui_guild_index_rebuilds_total {guild_index.stats['rebuilds']}")
+    lines.append("# HELP duidui_ticket_owner_lookups_total 工单开票人查找（hit 为命中缓存，miss 需要读取频道历史）")
+    lines.append("# TYPE duidui_ticket_owner_lookups_total counter")
+    for result, key in (("hit", "hits"), ("miss", "misses")):
+        lines.append(f"duidui_ticket_owner_lookups_total{_metric_labels(result=result)} {ticket_owner_stats[key]}")
+
+    lines.append("# HELP duidui_storage_call_seconds 存储调用耗时")
+    lines.append("# TYPE duidui_storage_call_seconds summary")
+    for name, stats in sorted(backend_stats.items()):
+        for q in (0.5, 0.95):
+            lines.append(f"duidui_storage_call_seconds{_metric_labels(call=name, quantile=q)} {stats.percentile(q):.6f}")
+        lines.append(f"duidui_storage_call_seconds_sum{_metric_labels(call=name)} {stats.total:.6f}")
+        lines.append(f"duidui_storage_call_seconds_count{_metric_labels(call=name)} {stats.count}")
+    lines.append("# TYPE duidui_storage_call_errors_total counter")
+    for name, stats in sorted(backend_stats.items()):
+        lines.append(f"duidui_storage_call_errors_total{_metric_labels(call=name)} {stats.errors}")
+    return "\n".join(lines) + "\n"
+
+async def publish_metrics_loop():
+    """定期在事件循环中渲染指标和健康状态，供 Flask 线程读取"""
+    global metrics_text, health_text, health_ok
+    while True:
+        try:
+            metrics_text = render_metrics()
+            health_ok, report = health_report()
+            health_text = json.dumps(report, ensure_ascii=False)
+        except Exception as e:
+            print(f"渲染指标失败: {e}")
+        await asyncio.sleep(METRICS_REFRESH_INTERVAL)
+
+# --- 事件循环延迟与慢调用 ---
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # 采样间隔（秒）
+SLOW_CALLBACK_THRESHOLD = float(os.getenv("SLOW_CALLBACK_THRESHOLD", "0.25"))  # 事件循环被阻塞多久记为慢调用（秒）
+SLOW_HANDLER_THRESHOLD = float(os.getenv("SLOW_HANDLER_THRESHOLD", "2.0"))  # 处理函数总耗时超过多久记为慢调用（秒）
+SLOW_STACK_SAMPLES = os.getenv("SLOW_STACK_SAMPLES", "true").lower() == "true"  # 阻塞时是否采样调用栈
+SLOW_REPORT_TOP = 10
+
+
+class SlowCallLog:
+    """最近的慢调用记录，按耗时取前 N 条用于报告"""
+
+    def __init__(self, keep=200):
+        self.records = deque(maxlen=keep)
+        self.counts = {}
+
+    def record(self, kind, name, seconds, stack=None):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.records.append({
+            "kind": kind,
+            "name": name,
+            "ms": round(seconds * 1000, 1),
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "stack": stack,
+        })
+        print(f"⚠️ 慢调用 [{kind}] {name}: {seconds * 1000:.0f}ms")
+
+    def top(self, n=SLOW_REPORT_TOP):
+        return heapq.nlargest(n, self.records, key=lambda r: r["ms"])
+
+
+slow_calls = SlowCallLog()
+
+def _describe_stack(frame):
+    """返回 (调用位置, 调用栈文本)，调用位置取本文件中最内层的函数"""
+    where = f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+    f = frame
+    while f is not None:
+        if f.f_code.co_filename == __file__:
+            where = f"{f.f_code.co_name}:{f.f_lineno}"
+            break
+        f = f.f_back
+    return where, "".join(traceback.format_stack(frame, limit=12))
+
+
+class LoopLagMonitor:
+    """定期测量事件循环延迟：sleep(interval) 实际多等了多久
+
+    延迟超过 threshold 时记为一次慢调用。开启 sample_stacks 时另有一个看门狗线程，
+    发现事件循环迟迟没有按时醒来，就用 sys._current_frames() 抓取事件循环线程当前的调用栈，
+    即正在阻塞事件循环的代码。
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=SLOW_CALLBACK_THRESHOLD,
+                 sample_stacks=SLOW_STACK_SAMPLES, samples=120):
+        self.interval = interval
+        self.threshold = threshold
+        self.sample_stacks = sample_stacks
+        self.recent = deque(maxlen=samples)
+        self.last = 0.0
+        self.max = 0.0
+        self.heartbeat = 0.0
+        self._sampled = None  # 看门狗为当前这次等待抓到的 (调用位置, 调用栈)
+        self._sampled_beat = None
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._watchdog_stop = threading.Event()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._loop_thread = threading.get_ident()
+            self.heartbeat = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+        if self.sample_stacks and (self._watchdog is None or not self._watchdog.is_alive()):
+            self._watchdog_stop.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            self._sampled = None
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.observe(max(loop.time() - started - self.interval, 0.0))
+
+    def observe(self, lag):
+        self.last = lag
+        self.max = max(self.max, lag)
+        self.recent.append(lag)
+        if lag >= self.threshold:
+            where, stack = self._sampled or ("事件循环阻塞", None)
+            slow_calls.record("loop", where, lag, stack)
+
+    def _watch(self):
+        # 只读写简单属性，不加锁，不影响事件循环
+        while not self._watchdog_stop.wait(self.threshold / 2):
+            beat = self.heartbeat
+            if beat == self._sampled_beat or time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._sampled_beat = beat
+                self._sampled = _describe_stack(frame)
+
+    def recent_max(self):
+        return max(self.recent) if self.recent else 0.0
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._watchdog_stop.set()
+
+
+loop_lag = LoopLagMonitor()
+
+# --- 保活 Web 服务（aiohttp） ---
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "1.0"))  # 最近延迟超过多少秒视为不健康
+health_text = "{}"
+health_ok = False
+
+def health_report():
+    """返回 (是否健康, 详情)：网关已连接、投票数据已加载、事件循环延迟正常"""
+    gateway = bot.is_ready() and not bot.is_closed() and bot.latency == bot.latency
+    lag = loop_lag.recent_max()
+    report = {
+        "gateway_connected": gateway,
+        "gateway_latency_ms": round(bot.latency * 1000, 1) if gateway else None,
+        "storage_loaded": votes_loaded,
+        "storage_type": STORAGE_TYPE,
+        "loop_lag_ms": round(loop_lag.last * 1000, 1),
+        "loop_lag_recent_max_ms": round(lag * 1000, 1),
+        "slowest": [{k: r[k] for k in ("kind", "name", "ms", "at")} for r in slow_calls.top(5)],
+    }
+    ok = gateway and votes_loaded and lag < HEALTH_MAX_LOOP_LAG
+    report["status"] = "ok" if ok else "unavailable"
+    return ok, report
+
+async def _web_home(request):
+    return web.Response(text="I'm alive!")
+
+async def _web_healthz(request):
+    ok, report = health_report()
+    return web.json_response(report, status=200 if ok else 503, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+async def _web_metrics(request):
+    return web.Response(text=render_metrics(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def start_web_server(host="0.0.0.0", port=WEB_PORT):
+    """在当前事件循环中启动保活 Web 服务，返回 AppRunner"""
+    web_app = web.Application()
+    web_app.router.add_get("/", _web_home)
+    web_app.router.add_get("/healthz", _web_healthz)
+    web_app.router.add_get("/metrics", _web_metrics)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"🌐 Web 服务已启动: http://{host}:{port}")
+    return runner
+# --- 事件录制 ---
+# 设置 EVENT_RECORD_FILE 后把到达 on_message、on_member_join 和组件交互的事件写成 JSONL，
+# 供 tools/replay.py 按真实流量回放。所有ID经过带密钥的哈希匿名化，消息内容只记录类别和长度。
+EVENT_RECORD_FILE = os.getenv("EVENT_RECORD_FILE")
+# 固定密钥可让多次录制中的同一ID对应同一个匿名ID，不设置则每次启动随机生成
+EVENT_RECORD_SALT = os.getenv("EVENT_RECORD_SALT")
+VOTE_CUSTOM_ID_PATTERN = re.compile(r"vote_(?P<vote_id>.+)_(?P<index>\d+)")
+
+
+class EventRecorder:
+    """记录格式（键名尽量短）：
+    {"e": "msg", "t": 秒, "g": 服务器, "c": 频道, "cn": 频道名, "a": 作者, "b": 是否机器人,
+     "r": [相关身份组], "k": "verify"/"kick"/"other", "n": 内容长度, "m": [被提及用户]}
+    {"e": "join", "t", "g", "u": 成员, "r"}
+    {"e": "click", "t", "g", "c", "u", "r", "v": 投票, "o": 选项} 或 {"e": "click", ..., "cid": 其他按钮ID}
+    """
+
+    def __init__(self, path=None, salt=None):
+        self.path = path
+        self.salt = (salt or os.urandom(16).hex()).encode()
+        self.count = 0
+        self._file = None
+        self._started = None
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def anon(self, value):
+        return int(hashlib.blake2b(str(value).encode(), key=self.salt[:64], digest_size=6).hexdigest(), 16)
+
+    def _roles(self, member):
+        names = (STAFF_ROLE_NAME, VERIFIED_ROLE_NAME, PENDING_ROLE_NAME)
+        return [name for name in names if getattr(member, "guild", None) is not None and guild_index.has_role(member, name)]
+
+    def _channel_name(self, channel):
+        name = getattr(channel, "name", "") or ""
+        for prefix in (TICKET_CHANNEL_PREFIX, "closed-"):
+            if name.startswith(prefix):
+                return f"{prefix}{self.anon(channel.id) % 10000:04d}"
+        return "channel"
+
+    def _write(self, record):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._started = time.monotonic()
+        record["t"] = round(time.monotonic() - self._started, 3)
+        # 使用文件缓冲区，不在每条记录后刷新
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+        self.count += 1
+
+    def message(self, message):
+        if not self.enabled or message.guild is None:
+            return
+        content = message.content or ""
+        if VERIFY_KEYWORDS_PATTERN.search(content):
+            kind = "verify"
+        elif content == KICK_KEYWORD:
+            kind = "kick"
+        else:
+            kind = "other"
+        self._write({
+            "e": "msg",
+            "g": self.anon(message.guild.id),
+            "c": self.anon(message.channel.id),
+            "cn": self._channel_name(message.channel),
+            "a": self.anon(message.author.id),
+            "b": message.author.bot,
+            "r": self._roles(message.author),
+            "k": kind,
+            "n": len(content),
+            "m": [self.anon(user.id) for user in message.mentions],
+        })
+
+    def member_join(self, member):
+        if not self.enabled:
+            return
+        self._write({"e": "join", "g": self.anon(member.guild.id), "u": self.anon(member.id), "r": self._roles(member)})
+
+    def interaction(self, interaction):
+        if not self.enabled or interaction.type != discord.InteractionType.component or interaction.guild is None:
+            return
+        custom_id = (interaction.data or {}).get("custom_id", "")
+        record = {
+            "e": "click",
+            "g": self.anon(interaction.guild.id),
+            "c": self.anon(interaction.channel_id),
+            "u": self.anon(interaction.user.id),
+            "r": self._roles(interaction.user),
+        }
+        match = VOTE_CUSTOM_ID_PATTERN.fullmatch(custom_id)
+        if match:
+            record["v"] = self.anon(match["vote_id"])
+            record["o"] = int(match["index"])
+        else:
+            record["cid"] = custom_id
+        self._write(record)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            print(f"事件录制已保存: {self.count} 条 -> {self.path}")
+
+
+event_recorder = EventRecorder(EVENT_RECORD_FILE, EVENT_RECORD_SALT)
+
+
+async def save_votes_data(changed_ids=None, mutations=None):
+    """保存投票数据，成功返回 True
+
+    changed_ids 为自上次保存以来被修改的投票ID；支持增量写入的存储方式
+    （cloudflare_kv）只写入这些投票，None 表示全量写入。
+    mutations 为本次写入合并的修改次数，用于 GitHub 提交说明。
+    """
     try:
         data = {
             "active_votes": active_votes,
@@ -111,16 +1133,21 @@ async def save_votes_data():
         }
         
         if STORAGE_TYPE == "cloudflare_kv":
-            await save_to_cloudflare_kv(data)
+            await save_to_cloudflare_kv(data, changed_ids)
         elif STORAGE_TYPE == "github":
-            await save_to_github(data)
+            await save_to_github(data, changed_ids, mutations)
+        elif STORAGE_TYPE == "journal":
+            # 直接整理出一份完整快照
+            await vote_journal.compact()
         else:
-            # 默认保存到本地文件
-            with open(VOTES_DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # 默认保存到本地文件（先写临时文件再替换，避免写一半时损坏）
+            with timed_backend_call("file.save"):
+                _atomic_write_text(VOTES_DATA_FILE, json.dumps(data, ensure_ascii=False, indent=2, default=_json_default))
+        return True
                 
     except Exception as e:
         print(f"保存投票数据失败: {e}")
+        return False
 
 async def load_votes_data():
     """加载投票数据"""
@@ -133,128 +1160,754 @@ async def load_votes_data():
         elif STORAGE_TYPE == "github":
             print("从 GitHub 加载数据...")
             return await load_from_github()
+        elif STORAGE_TYPE == "journal":
+            print("从本地快照和日志加载数据...")
+            with timed_backend_call("journal.load"):
+                return vote_journal.load()
         else:
             # 默认从本地文件加载
             print("从本地文件加载数据...")
             if os.path.exists(VOTES_DATA_FILE):
                 print(f"找到数据文件: {VOTES_DATA_FILE}")
-                with open(VOTES_DATA_FILE, 'r', encoding='utf-8') as f:
+                with timed_backend_call("file.load"), open(VOTES_DATA_FILE, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     return data.get("active_votes", {})
             else:
                 print(f"数据文件不存在: {VOTES_DATA_FILE}")
     except Exception as e:
         print(f"加载投票数据失败: {e}")
-        import traceback
         traceback.print_exc()
     return {}
 
-async def save_to_cloudflare_kv(data):
-    """保存到 Cloudflare KV"""
-    if not all([CLOUDFLARE_ACCOUNT_ID, CLOUDFLARE_NAMESPACE_ID, CLOUDFLARE_API_TOKEN]):
-        raise Exception("Cloudflare KV 配置不完整")
-    
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/storage/kv/namespaces/{CLOUDFLARE_NAMESPACE_ID}/values/votes_data"
-    headers = {
+def _atomic_write_text(path, text):
+    """写入临时文件后原子替换目标文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class VoteJournal:
+    """投票日志：快照 + 追加日志
+
+    每条修改（create/vote/end）以一行紧凑 JSON 追加到日志，代价与投票人数无关。
+    整理时先把当前日志轮转为 .compacting，再把内存状态原子写成快照，成功后删除旧日志。
+    回放规则是幂等的，整理中途崩溃重复回放也不会出错。
+    """
+
+    def __init__(self, snapshot_path, journal_path):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.rotated_path = f"{journal_path}.compacting"
+        self.records_since_compact = 0
+        self.last_compact = time.monotonic()
+        self.compact_count = 0
+        self._compact_task = None
+
+    def append(self, records):
+        """追加一批记录（同步写入并 fsync）"""
+        if not records:
+            return
+        lines = "".join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + "\n" for r in records)
+        try:
+            with timed_backend_call("journal.append"), open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            # 写了一半（如磁盘已满）时截掉残行，重试的记录才不会接在残行后面
+            self._truncate_torn_tail(self.journal_path)
+            raise
+        self.records_since_compact += len(records)
+
+        if (self.records_since_compact >= JOURNAL_COMPACT_RECORDS
+                or time.monotonic() - self.last_compact >= JOURNAL_COMPACT_INTERVAL):
+            self.schedule_compaction()
+
+    @staticmethod
+    def _truncate_torn_tail(path):
+        """截掉文件末尾没有换行的残行，返回截掉的字节数"""
+        try:
+            with open(path, 'rb+') as f:
+                data = f.read()
+                if not data or data.endswith(b"\n"):
+                    return 0
+                keep = data.rfind(b"\n") + 1
+                f.truncate(keep)
+                f.flush()
+                os.fsync(f.fileno())
+                return len(data) - keep
+        except OSError as e:
+            print(f"⚠️ 无法修复日志文件 {path}: {e}")
+            return 0
+
+    def schedule_compaction(self):
+        """在后台整理日志"""
+        if self._compact_task is not None and not self._compact_task.done():
+            return
+        self._compact_task = asyncio.create_task(self._compact_in_background())
+
+    async def _compact_in_background(self):
+        try:
+            await self.compact()
+        except Exception as e:
+            print(f"整理投票日志失败: {e}")
+
+    async def compact(self):
+        with timed_backend_call("journal.compact"):
+            await self._compact()
+
+    async def _compact(self):
+        """把当前内存状态写成快照并清理日志"""
+        # 以下到 to_thread 之前没有 await，序列化与日志轮转之间不会插入新的修改
+        text = json.dumps({
+            "active_votes": active_votes,
+            "timestamp": datetime.now().isoformat()
+        }, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+        if os.path.exists(self.journal_path):
+            if os.path.exists(self.rotated_path):
+                # 上次整理失败留下的旧日志，先合并
+                with open(self.journal_path, 'r', encoding='utf-8') as src, \
+                        open(self.rotated_path, 'a', encoding='utf-8') as dst:
+                    dst.write(src.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+        compacted = self.records_since_compact
+        self.records_since_compact = 0
+        self.last_compact = time.monotonic()
+
+        await asyncio.to_thread(_atomic_write_text, self.snapshot_path, text)
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+        self.compact_count += 1
+        print(f"投票日志整理完成：{compacted} 条记录写入快照 ({len(text)} 字节)")
+
+    def load(self):
+        """读取快照并回放日志"""
+        votes = {}
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    votes = json.load(f).get("active_votes", {})
+                print(f"读取快照: {len(votes)} 个投票")
+            except ValueError as e:
+                print(f"⚠️ 快照文件损坏，将只回放日志: {e}")
+
+        replayed = bad = 0
+        for path in (self.rotated_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            # 崩溃时可能留下写了一半的最后一行：先截掉，否则之后追加的记录会接在残行后面一起损坏
+            torn = self._truncate_torn_tail(path)
+            if torn:
+                bad += 1
+                print(f"⚠️ 日志 {path} 末尾有 {torn} 字节不完整记录，已截断")
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        bad += 1
+                        continue
+                    self.apply(votes, record)
+                    replayed += 1
+        print(f"回放日志: {replayed} 条记录" + (f"，跳过 {bad} 条损坏记录" if bad else ""))
+        self.records_since_compact = replayed
+        return votes
+
+    @staticmethod
+    def apply(votes, record):
+        """把一条日志记录应用到投票数据（幂等）"""
+        op = record.get("op")
+        vote_id = record.get("id")
+        if op == "create":
+            votes.setdefault(vote_id, record["vote"])
+        elif op == "vote":
+            vote_data = votes.get(vote_id)
+            if vote_data is None or record["uid"] in vote_data["voters"]:
+                return
+            vote_data["votes"][record["o"]] += 1
+            vote_data["voters"][record["uid"]] = {
+                "option": record["o"],
+                "user": record["u"],
+                "time": record["t"]
+            }
+        elif op == "update":
+            vote_data = votes.get(vote_id)
+            if vote_data is not None:
+                vote_data.update(record["fields"])
+        elif op == "end":
+            votes.pop(vote_id, None)
+
+
+vote_journal = VoteJournal(VOTES_DATA_FILE, VOTES_JOURNAL_FILE)
+
+def _kv_configured():
+    return all([CLOUDFLARE_ACCOUNT_ID, CLOUDFLARE_NAMESPACE_ID, CLOUDFLARE_API_TOKEN])
+
+def _kv_url(key):
+    return (f"{CLOUDFLARE_API_BASE}/accounts/{CLOUDFLARE_ACCOUNT_ID}/storage/kv/namespaces/"
+            f"{CLOUDFLARE_NAMESPACE_ID}/values/{quote(key, safe='')}")
+
+def _kv_headers():
+    return {
         "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
         "Content-Type": "application/json"
     }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.put(url, headers=headers, json=data) as response:
-            if response.status != 200:
-                raise Exception(f"Cloudflare KV 保存失败: {response.status}")
+
+# 上次成功写入的索引内容，None 表示未知（需要全量写入）
+_kv_index_ids = None
+
+async def _kv_put(key, value):
+    session = get_http_session()
+    body = json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+    async with session.put(_kv_url(key), headers=_kv_headers(), data=body.encode('utf-8')) as response:
+        if response.status != 200:
+            raise Exception(f"Cloudflare KV 保存失败 ({key}): {response.status}")
+
+async def _kv_delete(key):
+    session = get_http_session()
+    async with session.delete(_kv_url(key), headers=_kv_headers()) as response:
+        if response.status not in (200, 404):
+            raise Exception(f"Cloudflare KV 删除失败 ({key}): {response.status}")
+
+async def _kv_get(key):
+    """读取一个键，不存在时返回 None"""
+    session = get_http_session()
+    async with session.get(_kv_url(key), headers=_kv_headers()) as response:
+        if response.status == 200:
+            return json.loads(await response.text())
+        if response.status == 404:
+            return None
+        error_text = await response.text()
+        raise Exception(f"Cloudflare KV 加载失败 ({key}): {response.status} - {error_text}")
+
+async def _kv_bounded_gather(coros):
+    """以有限并发执行一组请求"""
+    semaphore = asyncio.Semaphore(KV_LOAD_CONCURRENCY)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+async def save_to_cloudflare_kv(data, changed_ids=None):
+    """保存到 Cloudflare KV（只重写被修改的投票键）"""
+    global _kv_index_ids
+    if not _kv_configured():
+        raise Exception("Cloudflare KV 配置不完整")
+
+    votes = data["active_votes"]
+    current_ids = set(votes)
+    if changed_ids is None or _kv_index_ids is None:
+        # 全量写入，同时清理索引里已不存在的投票
+        changed_ids = current_ids | (_kv_index_ids or set())
+
+    to_put = [vid for vid in changed_ids if vid in votes]
+    to_delete = [vid for vid in changed_ids if vid not in votes]
+
+    with timed_backend_call("cloudflare_kv.save"):
+        # 先写投票，再写索引，最后删除，保证索引不会指向不存在的投票
+        await _kv_bounded_gather([_kv_put(KV_VOTE_KEY_PREFIX + vid, votes[vid]) for vid in to_put])
+        if current_ids != _kv_index_ids:
+            await _kv_put(KV_INDEX_KEY, {"votes": sorted(current_ids), "timestamp": data["timestamp"]})
+            _kv_index_ids = current_ids
+        await _kv_bounded_gather([_kv_delete(KV_VOTE_KEY_PREFIX + vid) for vid in to_delete])
 
 async def load_from_cloudflare_kv():
     """从 Cloudflare KV 加载"""
-    if not all([CLOUDFLARE_ACCOUNT_ID, CLOUDFLARE_NAMESPACE_ID, CLOUDFLARE_API_TOKEN]):
+    global _kv_index_ids
+    if not _kv_configured():
         print("❌ Cloudflare KV 配置不完整")
         print(f"  - CLOUDFLARE_ACCOUNT_ID: {'✅' if CLOUDFLARE_ACCOUNT_ID else '❌'}")
         print(f"  - CLOUDFLARE_NAMESPACE_ID: {'✅' if CLOUDFLARE_NAMESPACE_ID else '❌'}")
         print(f"  - CLOUDFLARE_API_TOKEN: {'✅' if CLOUDFLARE_API_TOKEN else '❌'}")
         return {}
     
-    # 正确的 Cloudflare KV API 格式
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/storage/kv/namespaces/{CLOUDFLARE_NAMESPACE_ID}/values/votes_data"
-    headers = {
-        "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    print(f"请求 URL: {url}")
     print(f"Account ID: {CLOUDFLARE_ACCOUNT_ID}")
     print(f"Namespace ID: {CLOUDFLARE_NAMESPACE_ID}")
     
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            print(f"Cloudflare KV 响应状态: {response.status}")
-            
+    with timed_backend_call("cloudflare_kv.load"):
+        index = await _kv_get(KV_INDEX_KEY)
+        if index is None:
+            # 还没有索引，尝试读取旧版整体存储，下次保存时迁移为新布局
+            legacy = await _kv_get(KV_LEGACY_KEY)
+            if legacy is None:
+                print("数据不存在于 Cloudflare KV")
+                return {}
+            votes = legacy.get("active_votes", {})
+            _kv_index_ids = None
+            print(f"从旧版存储加载了 {len(votes)} 个投票，将在下次保存时迁移")
+            return votes
+
+        vote_ids = index.get("votes", [])
+        results = await _kv_bounded_gather([_kv_get(KV_VOTE_KEY_PREFIX + vid) for vid in vote_ids])
+
+    votes = {}
+    for vid, vote_data in zip(vote_ids, results):
+        if vote_data is None:
+            print(f"⚠️ 索引中的投票 {vid} 不存在，已跳过")
+            continue
+        votes[vid] = vote_data
+    _kv_index_ids = set(vote_ids)
+    print(f"成功加载数据，包含 {len(votes)} 个投票")
+    return votes
+
+# 各文件上次已知的 GitHub SHA（路径 -> SHA），加载或提交成功后更新，发生冲突时重新获取
+_github_shas = {}
+
+def _github_url(path):
+    return f"{GITHUB_API_BASE}/repos/{GITHUB_REPO}/contents/{path}"
+
+def _github_headers():
+    return {"Authorization": f"token {GITHUB_TOKEN}"}
+
+def _github_ref_params(branch):
+    return {"ref": branch} if branch else None
+
+async def _github_fetch_sha(path, branch=None):
+    session = get_http_session()
+    with timed_backend_call("github.get_sha"):
+        async with session.get(_github_url(path), headers=_github_headers(),
+                               params=_github_ref_params(branch)) as response:
             if response.status == 200:
-                # Cloudflare KV 返回的是原始文本，需要解析 JSON
-                text_data = await response.text()
-                print(f"原始响应: {text_data[:200]}...")
-                data = json.loads(text_data)
-                print(f"成功加载数据，包含 {len(data.get('active_votes', {}))} 个投票")
-                return data.get("active_votes", {})
+                file_data = await response.json()
+                return file_data["sha"]
+            return None
+
+async def _github_get_json(path, call_name, branch=None):
+    """读取 GitHub 上的 JSON 文件，不存在时返回 None（branch 为空时读取默认分支）"""
+    session = get_http_session()
+    with timed_backend_call(call_name):
+        async with session.get(_github_url(path), headers=_github_headers(),
+                               params=_github_ref_params(branch)) as response:
+            if response.status == 200:
+                file_data = await response.json()
+                _github_shas[path] = file_data["sha"]
+                content = base64.b64decode(file_data["content"]).decode()
+                return json.loads(content)
             elif response.status == 404:
-                print("数据不存在于 Cloudflare KV")
-                return {}  # 数据不存在
+                _github_shas[path] = None
+                return None
             else:
-                error_text = await response.text()
-                print(f"Cloudflare KV 错误响应: {error_text}")
-                raise Exception(f"Cloudflare KV 加载失败: {response.status} - {error_text}")
+                raise Exception(f"GitHub 加载失败: {response.status}")
 
-async def save_to_github(data):
-    """保存到 GitHub"""
-    if not all([GITHUB_TOKEN, GITHUB_REPO]):
-        raise Exception("GitHub 配置不完整")
+# 已确认存在的分支
+_github_branches = set()
+
+async def _github_ensure_branch(branch):
+    """分支不存在时从仓库默认分支的最新提交创建"""
+    if branch in _github_branches:
+        return
+    session = get_http_session()
+    repo_url = f"{GITHUB_API_BASE}/repos/{GITHUB_REPO}"
+    with timed_backend_call("github.ensure_branch"):
+        async with session.get(f"{repo_url}/git/ref/heads/{quote(branch)}", headers=_github_headers()) as response:
+            if response.status == 200:
+                _github_branches.add(branch)
+                return
+            if response.status != 404:
+                raise Exception(f"GitHub 查询分支 {branch} 失败: {response.status}")
+        async with session.get(repo_url, headers=_github_headers()) as response:
+            if response.status != 200:
+                raise Exception(f"GitHub 读取仓库信息失败: {response.status}")
+            default_branch = (await response.json())["default_branch"]
+        async with session.get(f"{repo_url}/git/ref/heads/{quote(default_branch)}", headers=_github_headers()) as response:
+            if response.status != 200:
+                raise Exception(f"GitHub 读取默认分支失败: {response.status}")
+            base_sha = (await response.json())["object"]["sha"]
+        payload = {"ref": f"refs/heads/{branch}", "sha": base_sha}
+        async with session.post(f"{repo_url}/git/refs", headers=_github_headers(), json=payload) as response:
+            # 422 表示分支已被并发创建
+            if response.status not in (201, 422):
+                raise Exception(f"GitHub 创建分支 {branch} 失败: {response.status}")
+    print(f"已在 GitHub 创建分支 {branch}")
+    _github_branches.add(branch)
+
+async def _github_put_json(path, data, message, branch=None):
+    """提交 JSON 文件，使用缓存的 SHA，冲突时重新获取后重试一次（branch 为空时提交到默认分支）"""
+    if branch:
+        await _github_ensure_branch(branch)
+    # 没有缓存的 SHA 时才先获取（文件不存在时为 None）
+    if path not in _github_shas:
+        _github_shas[path] = await _github_fetch_sha(path, branch)
     
-    # 先获取文件的 SHA（如果存在）
-    url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}"
-    headers = {"Authorization": f"token {GITHUB_TOKEN}"}
+    content = base64.b64encode(json.dumps(data, ensure_ascii=False, indent=2, default=_json_default).encode()).decode()
+    session = get_http_session()
     
-    sha = None
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                file_data = await response.json()
-                sha = file_data["sha"]
-        
-        # 更新或创建文件
-        import base64
-        content = base64.b64encode(json.dumps(data, ensure_ascii=False, indent=2).encode()).decode()
-        
+    for attempt in range(2):
         payload = {
-            "message": f"Update votes data - {datetime.now().isoformat()}",
+            "message": message,
             "content": content
         }
-        if sha:
-            payload["sha"] = sha
+        if _github_shas[path]:
+            payload["sha"] = _github_shas[path]
+        if branch:
+            payload["branch"] = branch
+        
+        with timed_backend_call("github.put"):
+            async with session.put(_github_url(path), headers=_github_headers(), json=payload) as response:
+                if response.status in (200, 201):
+                    result = await response.json()
+                    _github_shas[path] = result.get("content", {}).get("sha")
+                    return
+                if response.status not in (409, 422) or attempt > 0:
+                    raise Exception(f"GitHub 保存失败: {response.status}")
         
-        async with session.put(url, headers=headers, json=payload) as response:
-            if response.status not in [200, 201]:
-                raise Exception(f"GitHub 保存失败: {response.status}")
+        # SHA 已过期（文件被其他人修改），重新获取后重试一次
+        print(f"GitHub 文件 {path} SHA 冲突，重新获取后重试")
+        _github_shas[path] = await _github_fetch_sha(path, branch)
+
+async def save_to_github(data, changed_ids=None, mutations=None):
+    """保存到 GitHub"""
+    if not all([GITHUB_TOKEN, GITHUB_REPO]):
+        raise Exception("GitHub 配置不完整")
+    
+    message = f"Update votes data - {datetime.now().isoformat()}"
+    if mutations:
+        message += f" ({mutations} changes across {len(changed_ids or ())} votes)"
+    await _github_put_json(GITHUB_FILE_PATH, data, message)
 
 async def load_from_github():
     """从 GitHub 加载"""
     if not all([GITHUB_TOKEN, GITHUB_REPO]):
         return {}
     
-    url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}"
-    headers = {"Authorization": f"token {GITHUB_TOKEN}"}
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                file_data = await response.json()
-                import base64
-                content = base64.b64decode(file_data["content"]).decode()
-                data = json.loads(content)
-                return data.get("active_votes", {})
-            elif response.status == 404:
-                return {}
-            else:
-                raise Exception(f"GitHub 加载失败: {response.status}")
+    data = await _github_get_json(GITHUB_FILE_PATH, "github.load")
+    if data is None:
+        return {}
+    return data.get("active_votes", {})
+
+# --- 附加状态存储 ---
+# 投票以外需要跨重启保留的小型状态（如工单索引），按当前存储方式保存：
+# 本地文件为 <name>.json，Cloudflare KV 为键 <name>，GitHub 为 GITHUB_AUX_BRANCH 分支中的 <name>.json
+async def save_aux_state(name, data):
+    if STORAGE_TYPE == "cloudflare_kv":
+        if not _kv_configured():
+            raise Exception("Cloudflare KV 配置不完整")
+        with timed_backend_call("cloudflare_kv.save_aux"):
+            await _kv_put(name, data)
+    elif STORAGE_TYPE == "github":
+        if not all([GITHUB_TOKEN, GITHUB_REPO]):
+            raise Exception("GitHub 配置不完整")
+        await _github_put_json(f"{name}.json", data, f"Update {name} - {datetime.now().isoformat()}",
+                               branch=GITHUB_AUX_BRANCH)
+    else:
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        with timed_backend_call("file.save_aux"):
+            await asyncio.to_thread(_atomic_write_text, f"{name}.json", text)
+
+async def load_aux_state(name):
+    """读取附加状态，不存在或读取失败时返回 None"""
+    try:
+        if STORAGE_TYPE == "cloudflare_kv":
+            if not _kv_configured():
+                return None
+            with timed_backend_call("cloudflare_kv.load_aux"):
+                return await _kv_get(name)
+        elif STORAGE_TYPE == "github":
+            if not all([GITHUB_TOKEN, GITHUB_REPO]):
+                return None
+            return await _github_get_json(f"{name}.json", "github.load_aux", branch=GITHUB_AUX_BRANCH)
+        else:
+            path = f"{name}.json"
+            if not os.path.exists(path):
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"加载 {name} 失败: {e}")
+        return None
+
+# --- 写回（write-behind）持久化 ---
+# 投票点击只标记数据已修改，由后台任务把一段时间内的多次修改合并成一次写入
+SAVE_FLUSH_INTERVAL = float(os.getenv("SAVE_FLUSH_INTERVAL", "5"))  # 最长写入间隔（秒）
+SAVE_FLUSH_MAX_PENDING = int(os.getenv("SAVE_FLUSH_MAX_PENDING", "100"))  # 累积多少次修改后立即写入
+
+
+class WriteBehindSaver:
+    """合并多次修改并延迟写入存储
+
+    writer 为 async 函数 writer(dirty_keys, mutations, records)，写入成功返回 True。
+    records 为调用 mark_dirty 时附带的增量记录（按顺序），不需要的存储方式可以忽略。
+    写入失败时修改会保留，下次再尝试。
+    min_interval 为两次写入之间的最短间隔（批量提交窗口），0 表示不限制。
+    """
+
+    def __init__(self, name, writer, interval=SAVE_FLUSH_INTERVAL, max_pending=SAVE_FLUSH_MAX_PENDING,
+                 min_interval=0):
+        self.name = name
+        self._writer = writer
+        self.interval = interval
+        self.max_pending = max_pending
+        self.min_interval = min_interval
+        self._last_flush_at = None
+        self._pending = 0
+        self._dirty_keys = set()
+        self._records = []
+        # asyncio 对象在事件循环启动后再创建（Python 3.9 会绑定创建时的循环）
+        self._wakeup = None
+        self._lock = None
+        self._task = None
+
+        # 统计：每次写入合并了多少次修改
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.mutation_count = 0
+        self.last_batch = 0
+        self.max_batch = 0
+        self.recent_batches = deque(maxlen=20)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def mark_dirty(self, key=None, record=None):
+        """记录一次修改，key 为被修改的对象（如投票ID），record 为可选的增量记录"""
+        self._pending += 1
+        self.mutation_count += 1
+        if key is not None:
+            self._dirty_keys.add(key)
+        if record is not None:
+            self._records.append(record)
+        if self._pending >= self.max_pending and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # 批量窗口内不写入，等到窗口结束
+            remaining = self.window_remaining()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            if self._pending:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f"[{self.name}] 后台写入失败: {e}")
+
+    def window_remaining(self):
+        """距离批量窗口结束还有多少秒"""
+        if not self.min_interval or self._last_flush_at is None:
+            return 0
+        return self.min_interval - (time.monotonic() - self._last_flush_at)
+
+    async def flush(self, respect_window=False):
+        """立即写入所有未保存的修改
+
+        respect_window=True 时如果仍在批量窗口内则不写入，交给后台任务在窗口结束时写入。
+        """
+        if respect_window and self._task is not None and self.window_remaining() > 0:
+            return True
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return True
+            pending, keys, records = self._pending, self._dirty_keys, self._records
+            self._pending, self._dirty_keys, self._records = 0, set(), []
+
+            start = time.perf_counter()
+            ok = False
+            try:
+                ok = await self._writer(keys, pending, records)
+            finally:
+                if not ok:
+                    # 写入失败，把修改放回去等待下次写入
+                    self._pending += pending
+                    self._dirty_keys |= keys
+                    self._records[:0] = records
+                    self.failed_flushes += 1
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if not ok:
+                print(f"[{self.name}] 写入失败：{pending} 次修改将在下次重试")
+                return False
+
+            self._last_flush_at = time.monotonic()
+            self.flush_count += 1
+            self.last_batch = pending
+            self.max_batch = max(self.max_batch, pending)
+            self.recent_batches.append(pending)
+            print(f"[{self.name}] 写入完成：合并 {pending} 次修改，耗时 {elapsed_ms:.0f}ms")
+            return True
+
+    async def stop(self):
+        """停止后台任务并做最后一次写入"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        print(f"[{self.name}] 写回统计: {self.stats()}")
+
+    def stats(self):
+        return {
+            "pending": self._pending,
+            "flushes": self.flush_count,
+            "failed_flushes": self.failed_flushes,
+            "mutations": self.mutation_count,
+            "last_batch": self.last_batch,
+            "max_batch": self.max_batch,
+            "avg_batch": round(sum(self.recent_batches) / len(self.recent_batches), 1) if self.recent_batches else 0,
+        }
+
+
+async def _write_votes(dirty_keys, mutations, records):
+    if STORAGE_TYPE == "journal":
+        # 只追加本批修改记录，代价与投票总人数无关
+        try:
+            vote_journal.append(records)
+            return True
+        except Exception as e:
+            print(f"写入投票日志失败: {e}")
+            return False
+    return await save_votes_data(dirty_keys, mutations)
+
+vote_saver = WriteBehindSaver(
+    "votes", _write_votes,
+    min_interval=GITHUB_COMMIT_WINDOW if STORAGE_TYPE == "github" else 0
+)
+
+# 附加状态的写回间隔：GitHub 上每次写入都是 GITHUB_AUX_BRANCH 分支上的一次提交，不比投票的批量提交窗口更频繁；
+# 重启时工单索引会重新扫描、成员检查会补扫离线期间加入的成员，延迟写入不会丢失状态
+AUX_SAVE_MIN_INTERVAL = max(GITHUB_COMMIT_WINDOW, GITHUB_AUX_COMMIT_INTERVAL) if STORAGE_TYPE == "github" else 0
+
+# --- 投票消息实时结果 ---
+LIVE_TALLY_INTERVAL = float(os.getenv("LIVE_TALLY_INTERVAL", "10"))  # 同一投票两次编辑的最短间隔（秒）
+LIVE_TALLY_CHANNEL_SPACING = float(os.getenv("LIVE_TALLY_CHANNEL_SPACING", "1.2"))  # 同一频道两次编辑的最短间隔（秒）
+
+def render_vote_message(vote_data):
+    """生成投票消息内容，开启实时结果时附带当前票数"""
+    end_time = datetime.fromisoformat(vote_data["end_time"])
+    vote_text = f"🗳️ **{vote_data['title']}**\n\n"
+    vote_text += f"结束时间：<t:{int(end_time.timestamp())}:F>\n"
+    vote_text += f"可投票身份组：{vote_data['allowed_role']}\n\n"
+    if vote_data.get("live_results"):
+        total_votes = sum(vote_data["votes"])
+        vote_text += f"📊 当前结果（共 {total_votes} 票）：\n"
+        for i, option in enumerate(vote_data["options"]):
+            votes = vote_data["votes"][i]
+            percentage = (votes / total_votes * 100) if total_votes > 0 else 0
+            vote_text += f"{i+1}. {option}：{votes}票 ({percentage:.1f}%)\n"
+        vote_text += "\n"
+    vote_text += "请点击下方按钮进行投票："
+    return vote_text
+
+
+class LiveTallyEditor:
+    """合并投票消息的编辑请求
+
+    每次投票只调用 mark()，每个投票最多一个后台任务，按 interval 间隔把最新票数写入原消息，
+    期间到达的投票全部合并到下一次编辑；同一频道的编辑之间至少间隔 channel_spacing 秒，
+    避免触发 Discord 的单频道编辑限速。
+    """
+
+    def __init__(self, interval=LIVE_TALLY_INTERVAL, channel_spacing=LIVE_TALLY_CHANNEL_SPACING):
+        self.interval = interval
+        self.channel_spacing = channel_spacing
+        self._dirty = set()
+        self._tasks = {}  # 投票ID -> 编辑任务
+        self._last_edit = {}  # 投票ID -> 上次编辑时间（monotonic）
+        self._channel_next = {}  # 频道ID -> 下一次允许编辑的时间（monotonic）
+        self.marks = 0
+        self.coalesced = 0
+        self.edits = 0
+        self.failed_edits = 0
+
+    def mark(self, vote_id):
+        """记录投票结果有变化，必要时启动该投票的编辑任务"""
+        vote_data = active_votes.get(vote_id)
+        if not vote_data or not vote_data.get("live_results") or not vote_data.get("message_id"):
+            return
+        self.marks += 1
+        if vote_id in self._dirty:
+            self.coalesced += 1
+        self._dirty.add(vote_id)
+        task = self._tasks.get(vote_id)
+        if task is None or task.done():
+            self._tasks[vote_id] = asyncio.create_task(self._run(vote_id))
+
+    async def _wait_channel_slot(self, channel_id):
+        now = time.monotonic()
+        next_allowed = self._channel_next.get(channel_id, now)
+        self._channel_next[channel_id] = max(now, next_allowed) + self.channel_spacing
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+
+    async def _run(self, vote_id):
+        try:
+            while vote_id in self._dirty:
+                wait = self._last_edit.get(vote_id, 0) + self.interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                vote_data = active_votes.get(vote_id)
+                if vote_data is None:
+                    break
+                await self._wait_channel_slot(vote_data["channel_id"])
+                self._dirty.discard(vote_id)
+                await self._edit(vote_id, vote_data)
+        finally:
+            if self._tasks.get(vote_id) is asyncio.current_task():
+                self._tasks.pop(vote_id, None)
+
+    async def _edit(self, vote_id, vote_data):
+        self._last_edit[vote_id] = time.monotonic()
+        channel = guild_index.channel(vote_data["channel_id"])
+        if channel is None:
+            return
+        try:
+            await channel.get_partial_message(vote_data["message_id"]).edit(content=render_vote_message(vote_data))
+            self.edits += 1
+        except discord.NotFound:
+            # 原消息已被删除，不再更新
+            vote_data["live_results"] = False
+            self.failed_edits += 1
+        except Exception as e:
+            self.failed_edits += 1
+            print(f"更新投票实时结果失败: {e}")
+
+    async def finish(self, vote_id, final_edit=True):
+        """投票结束时取消等待中的编辑；final_edit 为 True 时立即写入最终票数"""
+        task = self._tasks.pop(vote_id, None)
+        if task is not None:
+            task.cancel()
+        self._dirty.discard(vote_id)
+        self._last_edit.pop(vote_id, None)
+        vote_data = active_votes.get(vote_id)
+        if final_edit and vote_data and vote_data.get("live_results") and vote_data.get("message_id"):
+            await self._edit(vote_id, vote_data)
+
+    def stats(self):
+        return {
+            "marks": self.marks,
+            "edits": self.edits,
+            "failed_edits": self.failed_edits,
+            "coalesced": self.coalesced,
+            "pending": len(self._dirty),
+        }
+
+
+live_tally = LiveTallyEditor()
 
 async def restore_vote_tasks():
     """恢复投票定时任务"""
@@ -280,60 +1933,80 @@ async def restore_vote_tasks():
     except Exception as e:
         print(f"恢复投票任务失败: {e}")
 
-class VoteView(discord.ui.View):
-    def __init__(self, vote_id: str, options: list, allowed_role: str, end_time: datetime):
-        super().__init__(timeout=None)
-        self.vote_id = vote_id
-        self.options = options
-        self.allowed_role = allowed_role
-        self.end_time = end_time
-        
-        # 为每个选项创建按钮
-        for i, option in enumerate(options):
-            button = discord.ui.Button(
-                label=f"{i+1}. {option}",
-                style=discord.ButtonStyle.secondary,
-                custom_id=f"vote_{vote_id}_{i}"
-            )
-            button.callback = self.create_vote_callback(i)
-            self.add_item(button)
+async def handle_vote_click(interaction: discord.Interaction, vote_id: str, option_index: int):
+    """处理投票按钮点击，所有投票共用"""
+    vote_data = active_votes.get(vote_id)
     
-    def create_vote_callback(self, option_index):
-        async def vote_callback(interaction: discord.Interaction):
-            # 检查投票是否还在进行
-            if self.vote_id not in active_votes:
-                await interaction.response.send_message("❌ 此投票已结束！", ephemeral=True)
-                return
-            
-            # 检查权限
-            if self.allowed_role != "@everyone":
-                allowed_role = discord.utils.get(interaction.guild.roles, name=self.allowed_role)
-                if not allowed_role or allowed_role not in interaction.user.roles:
-                    await interaction.response.send_message(f"❌ 权限不足：只有 `{self.allowed_role}` 身份组可以参与此投票！", ephemeral=True)
-                    return
-            
-            vote_data = active_votes[self.vote_id]
-            user_id = str(interaction.user.id)
-            
-            # 检查是否已经投票
-            if user_id in vote_data["voters"]:
-                await interaction.response.send_message("❌ 您已经投过票了！", ephemeral=True)
-                return
-            
-            # 记录投票
-            vote_data["votes"][option_index] += 1
-            vote_data["voters"][user_id] = {
-                "option": option_index,
-                "user": str(interaction.user),
-                "time": datetime.now().isoformat()
-            }
-            
-            # 保存到存储
-            await save_votes_data()
-            
-            await interaction.response.send_message(f"✅ 您的投票已记录：{self.options[option_index]}", ephemeral=True)
-        
-        return vote_callback
+    # 检查投票是否还在进行
+    if vote_data is None:
+        await interaction.response.send_message("❌ 此投票已结束！", ephemeral=True)
+        return
+    
+    if not 0 <= option_index < len(vote_data["options"]):
+        await interaction.response.send_message("❌ 无效的投票选项！", ephemeral=True)
+        return
+    
+    # 检查权限
+    allowed_role = vote_data["allowed_role"]
+    if allowed_role != "@everyone":
+        if not guild_index.has_role(interaction.user, allowed_role):
+            await interaction.response.send_message(f"❌ 权限不足：只有 `{allowed_role}` 身份组可以参与此投票！", ephemeral=True)
+            return
+    
+    user_id = interaction.user.id
+    
+    # 检查是否已经投票
+    if user_id in vote_data["voters"]:
+        await interaction.response.send_message("❌ 您已经投过票了！", ephemeral=True)
+        return
+    
+    # 记录投票
+    now = datetime.now()
+    user_name = str(interaction.user)
+    vote_data["votes"][option_index] += 1
+    vote_data["voters"].add(user_id, option_index, user_name, now.timestamp())
+    record_recent_voter(vote_id, option_index, user_name)
+    
+    # 标记修改，由后台合并写入
+    vote_saver.mark_dirty(vote_id, {
+        "op": "vote", "id": vote_id, "uid": str(user_id),
+        "o": option_index, "u": user_name, "t": now.isoformat()
+    })
+    live_tally.mark(vote_id)
+    
+    await interaction.response.send_message(f"✅ 您的投票已记录：{vote_data['options'][option_index]}", ephemeral=True)
+
+
+class VoteButton(discord.ui.DynamicItem[discord.ui.Button], template=VOTE_CUSTOM_ID_PATTERN.pattern):
+    """投票按钮
+
+    custom_id 中带有投票ID和选项序号，启动时注册一次即可响应所有投票（包括重启前创建的投票），
+    不需要为每个投票保存 View。
+    """
+
+    def __init__(self, vote_id: str, option_index: int, label: str = None):
+        super().__init__(discord.ui.Button(
+            label=label or str(option_index + 1),
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"vote_{vote_id}_{option_index}"
+        ))
+        self.vote_id = vote_id
+        self.option_index = option_index
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match["vote_id"], int(match["index"]), item.label)
+
+    async def callback(self, interaction: discord.Interaction):
+        await handle_vote_click(interaction, self.vote_id, self.option_index)
+
+
+def build_vote_view(vote_id: str, options: list):
+    """为投票消息生成按钮（只用于发送消息，点击由 VoteButton 处理）"""
+    view = discord.ui.View(timeout=None)
+    for i, option in enumerate(options):
+        view.add_item(VoteButton(vote_id, i, f"{i+1}. {option}"))
+    return view
 
 async def end_vote(vote_id: str, channel_id: int, guild_id: int):
     """结束投票并公布结果"""
@@ -364,70 +2037,404 @@ async def end_vote(vote_id: str, channel_id: int, guild_id: int):
             result_text = "\n".join(result_lines)
         
         # 发送结果
+        await live_tally.finish(vote_id)
         await channel.send(result_text)
         
         # 清理数据
         active_votes.pop(vote_id, None)
+        _recent_voters.pop(vote_id, None)
+        vote_registry.unregister(vote_id, vote_data)
         vote_tasks.pop(vote_id, None)
         
-        # 保存到存储
-        await save_votes_data()
+        # 投票结束时立即写入（GitHub 批量提交模式下在当前窗口结束时写入）
+        vote_saver.mark_dirty(vote_id, {"op": "end", "id": vote_id})
+        await vote_saver.flush(respect_window=True)
         
     except Exception as e:
         print(f"结束投票时发生错误: {e}")
 
 # --- 48小时未创建工单且未审核 自动踢出逻辑 ---
 CHECK_DELAY_SECONDS = 48 * 60 * 60
-_member_check_tasks = {}
 
-async def _member_has_ticket(guild: discord.Guild, member: discord.Member) -> bool:
-    """只有当成员在其ticket频道中实际发过消息时才视为有工单。"""
-    for channel in guild.text_channels:
+# 事件循环只持有任务的弱引用，一次性的后台任务需要保留引用直到完成，否则可能在运行中被回收
+_background_tasks = set()
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+class TimerScheduler:
+    """基于最小堆的定时器，由一个后台任务按截止时间依次触发
+
+    截止时间为 time.time() 时间戳。handler 为 async 函数 handler(key)，到期后在独立任务中执行。
+    调度、取消、重新调度均为 O(log n)；取消采用惰性删除，堆中残留过多时整体重建。
+    """
+
+    _REMOVED = object()
+    # 最长等待时间，防止系统时间被调整后错过截止时间
+    _MAX_SLEEP = 300
+
+    def __init__(self, name, handler):
+        self.name = name
+        self._handler = handler
+        self._heap = []  # [截止时间, 序号, key]
+        self._entries = {}  # key -> 堆中的条目
+        self._running = set()
+        self._removed = 0
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self.fired_count = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._running
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, key, deadline):
+        """安排 key 在 deadline 触发，已存在时改为新的截止时间"""
+        self.cancel(key)
+        entry = [deadline, next(self._seq), key]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry and self._wakeup is not None:
+            # 新的最早截止时间，唤醒后台任务重新计算等待时间
+            self._wakeup.set()
+
+    def cancel(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[2] = self._REMOVED
+        self._removed += 1
+        if self._removed > 64 and self._removed > len(self._entries):
+            self._heap = [e for e in self._heap if e[2] is not self._REMOVED]
+            heapq.heapify(self._heap)
+            self._removed = 0
+        return True
+
+    def items(self):
+        """返回所有 (key, 截止时间)"""
+        return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def deadline_of(self, key):
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def next_deadline(self):
+        while self._heap and self._heap[0][2] is self._REMOVED:
+            heapq.heappop(self._heap)
+            self._removed -= 1
+        return self._heap[0][0] if self._heap else None
+
+    def stats(self):
+        next_deadline = self.next_deadline()
+        return {
+            "depth": len(self._entries),
+            "running": len(self._running),
+            "fired": self.fired_count,
+            "next_deadline": next_deadline,
+            "next_in_seconds": round(next_deadline - time.time(), 1) if next_deadline else None,
+        }
+
+    async def _run(self):
+        while True:
+            next_deadline = self.next_deadline()
+            timeout = self._MAX_SLEEP
+            if next_deadline is not None:
+                timeout = min(timeout, max(0, next_deadline - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            now = time.time()
+            while self.next_deadline() is not None and self._heap[0][0] <= now:
+                _, _, key = heapq.heappop(self._heap)
+                del self._entries[key]
+                self.fired_count += 1
+                self._running.add(key)
+                spawn_background(self._fire(key))
+
+    async def _fire(self, key):
         try:
+            await self._handler(key)
+        except Exception as e:
+            print(f"[{self.name}] 定时任务 {key} 执行失败: {e}")
+        finally:
+            self._running.discard(key)
+
+# --- 成员工单活跃索引 ---
+# 记录每个工单频道的开票人以及开票人是否在频道中发过言，由 on_message 增量更新，
+# 使"成员是否有有效工单"的判断不需要遍历所有工单频道的历史消息
+TICKET_INDEX_STATE = "ticket_index"
+
+
+class TicketActivityIndex:
+    """工单频道 -> 开票人/是否发言 的索引，以及成员 -> 工单频道 的反向索引"""
+
+    def __init__(self):
+        # 频道ID -> {"guild": 服务器ID, "owner": 开票人ID 或 None, "posted": 开票人是否发过言}
+        self.channels = {}
+        # (服务器ID, 成员ID) -> {频道ID, ...}
+        self._by_member = {}
+        self._scanning = set()
+        self._ready = None
+        self._rebuild_task = None
+        # 冷启动扫描是否完整完成；失败时按服务器在查询前补扫
+        self.complete = False
+        self.started = False
+        self.scan_count = 0
+
+    def _link(self, channel_id, entry):
+        if entry["owner"] is not None:
+            self._by_member.setdefault((entry["guild"], entry["owner"]), set()).add(channel_id)
+
+    def _unlink(self, channel_id, entry):
+        key = (entry["guild"], entry["owner"])
+        channel_ids = self._by_member.get(key)
+        if channel_ids is not None:
+            channel_ids.discard(channel_id)
+            if not channel_ids:
+                del self._by_member[key]
+
+    def set_owner(self, guild_id, channel_id, owner_id, posted=False):
+        entry = self.channels.get(channel_id)
+        if entry is not None:
+            if entry["owner"] == owner_id:
+                return
+            self._unlink(channel_id, entry)
+        entry = {"guild": guild_id, "owner": owner_id, "posted": posted}
+        self.channels[channel_id] = entry
+        self._link(channel_id, entry)
+        ticket_index_saver.mark_dirty()
+
+    def remove_channel(self, channel_id):
+        entry = self.channels.pop(channel_id, None)
+        if entry is not None:
+            self._unlink(channel_id, entry)
+            ticket_index_saver.mark_dirty()
+
+    def mark_posted(self, channel_id):
+        entry = self.channels.get(channel_id)
+        if entry is not None and not entry["posted"]:
+            entry["posted"] = True
+            ticket_index_saver.mark_dirty()
+
+    def record_message(self, message):
+        """on_message 中调用：开票人在自己的工单中发言"""
+        entry = self.channels.get(message.channel.id)
+        if entry is None:
+            # 还没有索引的工单频道，后台扫描一次
+            if self.is_ready():
+                self.schedule_scan(message.channel)
+            return
+        if not entry["posted"] and entry["owner"] == message.author.id:
+            entry["posted"] = True
+            ticket_index_saver.mark_dirty()
+
+    def channels_of(self, guild_id, member_id):
+        """返回成员作为开票人的工单频道ID"""
+        return self._by_member.get((guild_id, member_id), set())
+
+    def schedule_scan(self, channel):
+        if channel.id in self._scanning:
+            return
+        self._scanning.add(channel.id)
+
+        async def _scan():
+            try:
+                await self.scan_channel(channel)
+            except Exception as e:
+                print(f"扫描工单频道 {channel.name} 失败: {e}")
+            finally:
+                self._scanning.discard(channel.id)
+
+        spawn_background(_scan())
+
+    async def scan_channel(self, channel):
+        """读取一次频道历史，同时识别开票人并判断其是否发过言"""
+        self.scan_count += 1
+        owner_id = None
+        authors = set()
+        position = 0
+        async for m in channel.history(limit=200, oldest_first=True):
+            if owner_id is None and position < 10 and m.author.bot and m.mentions:
+                owner_id = m.mentions[0].id
+            elif m.author and not m.author.bot:
+                authors.add(m.author.id)
+            position += 1
+        if owner_id is not None:
+            _ticket_owner_cache[channel.id] = owner_id
+        self.set_owner(channel.guild.id, channel.id, owner_id, posted=owner_id in authors)
+
+    async def _scan_missing(self, guild, existing=None):
+        """扫描服务器中尚未索引的工单频道（每个频道只扫描一次），返回扫描数量"""
+        scanned = 0
+        for channel in guild.text_channels:
             if not channel.name.startswith(TICKET_CHANNEL_PREFIX):
                 continue
-            # 查找工单开头的机器人提示并识别被@的开票人
-            is_owner = False
-            async for old_message in channel.history(limit=10, oldest_first=True):
-                if old_message.author.bot and old_message.mentions:
-                    ticket_owner = old_message.mentions[0]
-                    if ticket_owner.id == member.id:
-                        is_owner = True
-                    break
-            if not is_owner:
+            if existing is not None:
+                existing.add(channel.id)
+            if channel.id in self.channels:
                 continue
+            try:
+                await self.scan_channel(channel)
+                scanned += 1
+            except Exception as e:
+                print(f"扫描工单频道 {channel.name} 失败: {e}")
+        return scanned
+
+    async def rebuild(self, guilds):
+        """冷启动：扫描尚未索引的工单频道，清理已删除的频道"""
+        try:
+            existing = set()
+            scanned = 0
+            for guild in guilds:
+                scanned += await self._scan_missing(guild, existing)
+            guild_ids = {guild.id for guild in guilds}
+            for channel_id, entry in list(self.channels.items()):
+                # 归档后改名的频道仍然保留在索引中
+                if channel_id in existing or entry["guild"] not in guild_ids:
+                    continue
+                if bot.get_channel(channel_id) is None:
+                    self.remove_channel(channel_id)
+            self.complete = True
+            print(f"工单索引已就绪：{len(self.channels)} 个频道，本次扫描 {scanned} 个")
+        except Exception as e:
+            print(f"⚠️ 工单索引重建失败，查询时将按服务器补扫: {e}")
+        finally:
+            # 无论成功与否都要放行等待者，否则成员检查会一直挂起
+            self._get_ready_event().set()
+
+    async def ensure_guild(self, guild):
+        """等待冷启动扫描；扫描未完整完成时先补扫该服务器"""
+        await self.wait_ready()
+        if not self.complete:
+            await self._scan_missing(guild)
+
+    def _get_ready_event(self):
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        return self._ready
+
+    def is_ready(self):
+        return self._ready is not None and self._ready.is_set()
+
+    async def wait_ready(self):
+        await self._get_ready_event().wait()
+
+    def to_json(self):
+        return {
+            "channels": {
+                str(cid): [e["guild"], e["owner"], e["posted"]] for cid, e in self.channels.items()
+            }
+        }
+
+    def load_json(self, data):
+        for cid, (guild_id, owner_id, posted) in data.get("channels", {}).items():
+            entry = {"guild": guild_id, "owner": owner_id, "posted": posted}
+            self.channels[int(cid)] = entry
+            self._link(int(cid), entry)
+            if owner_id is not None:
+                _ticket_owner_cache.setdefault(int(cid), owner_id)
+
+    async def start(self, guilds):
+        """加载持久化的索引并在后台补全，只在首次就绪时执行"""
+        if self.started:
+            return
+        self.started = True
+        data = await load_aux_state(TICKET_INDEX_STATE)
+        if data:
+            self.load_json(data)
+            print(f"已加载工单索引：{len(self.channels)} 个频道")
+        self._rebuild_task = asyncio.create_task(self.rebuild(guilds))
+
 
-            # 必须成员自己在该频道发过至少一条消息，才算有效工单
+async def _write_ticket_index(dirty_keys, mutations, records):
+    try:
+        await save_aux_state(TICKET_INDEX_STATE, ticket_activity.to_json())
+        return True
+    except Exception as e:
+        print(f"保存工单索引失败: {e}")
+        return False
+
+ticket_activity = TicketActivityIndex()
+ticket_index_saver = WriteBehindSaver("ticket_index", _write_ticket_index, interval=30,
+                                     min_interval=AUX_SAVE_MIN_INTERVAL)
+
+async def _member_has_ticket(guild: discord.Guild, member: discord.Member, budget=None) -> bool:
+    """只有当成员在其ticket频道中实际发过消息时才视为有工单。"""
+    await ticket_activity.ensure_guild(guild)
+    for channel_id in list(ticket_activity.channels_of(guild.id, member.id)):
+        channel = guild.get_channel(channel_id)
+        if channel is None or not channel.name.startswith(TICKET_CHANNEL_PREFIX):
+            continue
+        if ticket_activity.channels[channel_id]["posted"]:
+            return True
+        # 索引显示尚未发言：只核对这一个频道，避免遗漏机器人离线期间的消息
+        try:
+            if budget:
+                await budget.acquire("history")
             async for m in channel.history(limit=200, oldest_first=True):
                 if m.author and not m.author.bot and m.author.id == member.id:
+                    ticket_activity.mark_posted(channel_id)
                     return True
-            # 没有成员消息则视为未有效创建工单
         except Exception:
             continue
+    # 没有成员消息则视为未有效创建工单
     return False
 
-async def _kick_if_still_unverified_and_no_ticket(member: discord.Member):
+async def _kick_if_still_unverified_and_no_ticket(member: discord.Member, budget=None, dry_run=False):
+    """检查并踢出超时成员
+
+    budget 为 RouteBudget 时每次 REST 调用前按路由限速；dry_run 时只报告不踢出。
+    返回处理结果："kicked"、"would_kick"、"skipped" 或 "failed"。
+    """
     guild = member.guild
     if guild is None:
-        return
+        return "skipped"
+
     try:
         # 重新获取对象，避免缓存造成信息不准
+        if budget:
+            await budget.acquire("fetch_member")
         member = await guild.fetch_member(member.id)
     except Exception:
-        return
-
-    verified_role = discord.utils.get(guild.roles, name=VERIFIED_ROLE_NAME)
-    pending_role = discord.utils.get(guild.roles, name=PENDING_ROLE_NAME)
+        return "skipped"
 
     # 已离开、已审核、或没有待审核角色，均不处理
-    if verified_role and verified_role in member.roles:
-        return
-    if pending_role is None or pending_role not in member.roles:
-        return
+    if guild_index.has_role(member, VERIFIED_ROLE_NAME):
+        return "skipped"
+    if not guild_index.has_role(member, PENDING_ROLE_NAME):
+        return "skipped"
 
     # 已经创建过工单则不处理
-    if await _member_has_ticket(guild, member):
-        return
+    if await _member_has_ticket(guild, member, budget):
+        return "skipped"
+
+    if dry_run:
+        log_sink.write(f"[预演] 将踢出成员 {member.mention} ({member})：48小时未审核且未创建工单。")
+        return "would_kick"
 
     # 私信说明并踢出
     try:
@@ -438,54 +2445,371 @@ async def _kick_if_still_unverified_and_no_ticket(member: discord.Member):
             "以下为本服务器的永久邀请链接：https://discord.com/invite/gtU8UCa22F"
         )
         try:
+            if budget:
+                await budget.acquire("dm")
             await member.send(dm_text)
         except Exception:
             pass
+        if budget:
+            await budget.acquire("kick")
         await member.kick(reason="加入48小时未创建工单且仍为待审核")
 
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"已踢出成员 {member.mention} ({member})：48小时未审核且未创建工单。")
+        log_sink.write(f"已踢出成员 {member.mention} ({member})：48小时未审核且未创建工单。")
+        return "kicked"
     except discord.Forbidden:
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"⚠️ 权限不足：无法踢出 {member.mention}（需要踢出成员权限且身份层级足够）。")
+        log_sink.write(f"⚠️ 权限不足：无法踢出 {member.mention}（需要踢出成员权限且身份层级足够）。")
     except Exception as e:
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"处理成员 {member.mention} 时发生错误：{e}")
+        log_sink.write(f"处理成员 {member.mention} 时发生错误：{e}")
+    return "failed"
+
+# --- 超时成员清理 ---
+# 到期的成员检查进入队列，由固定数量的工作任务处理，并按路由限制请求速率，
+# 避免重启后大量超时成员同时触发导致请求被 Discord 限流
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", "3"))
+# 每个路由每秒最多请求数，格式 "路由=次数,..."；未列出的路由不限速
+SWEEP_ROUTE_BUDGET = os.getenv("SWEEP_ROUTE_BUDGET", "fetch_member=5,history=2,dm=1,kick=1")
+SWEEP_PROGRESS_EVERY = int(os.getenv("SWEEP_PROGRESS_EVERY", "25"))  # 每处理多少人报告一次进度
+# 预演模式：只在日志频道报告将被踢出的成员，并在 SWEEP_DRY_RUN_RECHECK 秒后重新检查，
+# 这样关闭预演后这些成员仍会被正常处理
+SWEEP_DRY_RUN = os.getenv("SWEEP_DRY_RUN", "0") == "1"
+SWEEP_DRY_RUN_RECHECK = int(os.getenv("SWEEP_DRY_RUN_RECHECK", "3600"))
+
+
+class RouteBudget:
+    """按路由限速：同一路由的相邻两次请求至少间隔 1/速率 秒"""
+
+    def __init__(self, spec):
+        self.rates = {}
+        for part in spec.split(","):
+            if "=" not in part:
+                continue
+            route, rate = part.split("=", 1)
+            if float(rate) > 0:
+                self.rates[route.strip()] = float(rate)
+        self._next_allowed = {}
+        self.waited = 0.0
+
+    async def acquire(self, route):
+        rate = self.rates.get(route)
+        if not rate:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_allowed.get(route, now))
+        self._next_allowed[route] = slot + 1 / rate
+        if slot > now:
+            self.waited += slot - now
+            await asyncio.sleep(slot - now)
+
+
+class KickSweeper:
+    """处理到期成员检查的工作池"""
+
+    def __init__(self, workers, budget, dry_run=False):
+        self.worker_count = workers
+        self.budget = budget
+        self.dry_run = dry_run
+        self._queue = None
+        self._queued = set()
+        self._in_flight = set()
+        self._workers = []
+        self._active = 0
+        # 当前批次（从队列非空到全部处理完）的统计
+        self._batch = None
+        self.totals = {"kicked": 0, "would_kick": 0, "skipped": 0, "failed": 0}
+
+    def __contains__(self, key):
+        return key in self._queued
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def pending_keys(self):
+        """排队中和正在处理的成员（处理完之前仍需持久化）"""
+        return self._queued | self._in_flight
+
+    def submit(self, key):
+        if key in self._queued:
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        if self._batch is None:
+            self._batch = {"total": 0, "done": 0, "kicked": 0, "would_kick": 0, "skipped": 0,
+                           "failed": 0, "started": time.monotonic()}
+        self._batch["total"] += 1
+        self._queued.add(key)
+        self._queue.put_nowait(key)
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            # 出队即移出去重集合，预演模式下才能重新安排检查
+            self._queued.discard(key)
+            self._in_flight.add(key)
+            self._active += 1
+            try:
+                result = await self._process(key)
+            except asyncio.CancelledError:
+                # 关闭时被取消：保留在 _in_flight 中，关闭前的最后一次写入仍会保存
+                self._active -= 1
+                raise
+            except Exception as e:
+                print(f"处理成员检查 {key} 失败: {e}")
+                result = "failed"
+            self._active -= 1
+            self._in_flight.discard(key)
+            # 处理完才从持久化的检查计划中移除
+            member_check_saver.mark_dirty()
+            self._queue.task_done()
+            await self._record(result)
+
+    async def _process(self, key):
+        guild_id, member_id = key
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            return "skipped"
+        member = guild.get_member(member_id)
+        if member is None:
+            # 已离开服务器
+            return "skipped"
+        result = await _kick_if_still_unverified_and_no_ticket(member, self.budget, self.dry_run)
+        if result == "would_kick":
+            await _schedule_member_check(member, SWEEP_DRY_RUN_RECHECK)
+        return result
+
+    async def _record(self, result):
+        self.totals[result] += 1
+        batch = self._batch
+        batch[result] += 1
+        batch["done"] += 1
+        finished = batch["done"] >= batch["total"]
+        if finished:
+            self._batch = None
+        # 单个成员正常到期的检查不报告进度
+        if batch["total"] <= 1:
+            return
+        if finished:
+            elapsed = time.monotonic() - batch["started"]
+            await self._report(f"🧹 清理完成：共 {batch['total']} 人，{self._format(batch)}，耗时 {elapsed:.0f} 秒")
+        elif batch["done"] % SWEEP_PROGRESS_EVERY == 0:
+            await self._report(f"🧹 清理进度 {batch['done']}/{batch['total']}：{self._format(batch)}")
+
+    def _format(self, batch):
+        if self.dry_run:
+            return f"将踢出 {batch['would_kick']}，跳过 {batch['skipped']}，失败 {batch['failed']}"
+        return f"踢出 {batch['kicked']}，跳过 {batch['skipped']}，失败 {batch['failed']}"
+
+    async def _report(self, text):
+        if self.dry_run:
+            text = "[预演] " + text
+        print(text)
+        log_sink.write(text)
+
+    def stats(self):
+        return {
+            "queued": len(self._queued),
+            "active": self._active,
+            "workers": len(self._workers),
+            "dry_run": self.dry_run,
+            **self.totals,
+        }
+
+
+sweep_budget = RouteBudget(SWEEP_ROUTE_BUDGET)
+kick_sweeper = KickSweeper(SWEEP_WORKERS, sweep_budget, SWEEP_DRY_RUN)
+
+async def _run_member_check(key):
+    # 到期后交给清理工作池处理；处理完之前仍由 _write_member_checks 持久化
+    kick_sweeper.submit(key)
+
+member_check_scheduler = TimerScheduler("member_check", _run_member_check)
+
+# 成员检查计划通过存储持久化，重启后直接恢复，无需遍历全部成员
+MEMBER_CHECK_STATE = "member_checks"
+
+async def _write_member_checks(dirty_keys, mutations, records):
+    saved_at = time.time()
+    checks = {f"{g}:{m}": deadline for (g, m), deadline in member_check_scheduler.items()}
+    # 已到期但清理工作池还没处理完的成员，重启后立即重新检查
+    for g, m in kick_sweeper.pending_keys():
+        checks.setdefault(f"{g}:{m}", saved_at)
+    data = {
+        "saved_at": saved_at,
+        "checks": checks
+    }
+    try:
+        await save_aux_state(MEMBER_CHECK_STATE, data)
+        return True
+    except Exception as e:
+        print(f"保存成员检查计划失败: {e}")
+        return False
+
+member_check_saver = WriteBehindSaver("member_checks", _write_member_checks, interval=30,
+                                     min_interval=AUX_SAVE_MIN_INTERVAL)
 
 async def _schedule_member_check(member: discord.Member, delay_seconds: int):
     # 防重复调度
     key = (member.guild.id, member.id)
-    if key in _member_check_tasks and not _member_check_tasks[key].done():
+    if key in member_check_scheduler or key in kick_sweeper:
+        return
+    member_check_scheduler.schedule(key, time.time() + max(0, delay_seconds))
+    member_check_saver.mark_dirty()
+
+def _cancel_member_check(guild_id, member_id):
+    if member_check_scheduler.cancel((guild_id, member_id)):
+        member_check_saver.mark_dirty()
+
+def _needs_member_check(member):
+    """有待审核身份组且没有已审核身份组"""
+    return guild_index.has_role(member, PENDING_ROLE_NAME) and not guild_index.has_role(member, VERIFIED_ROLE_NAME)
+
+async def _schedule_member_check_from_join(member):
+    """按加入时间安排检查（加入已满48小时则立即检查）"""
+    if member.joined_at is None:
         return
+    # Discord 的 joined_at 是UTC时间
+    elapsed = (discord.utils.utcnow() - member.joined_at).total_seconds()
+    await _schedule_member_check(member, int(CHECK_DELAY_SECONDS - elapsed))
+
+async def _scan_pending_members(guilds, joined_after=None):
+    """遍历成员并为待审核成员安排检查，joined_after 为时间戳时只处理此后加入的成员"""
+    scanned = 0
+    for guild in guilds:
+        pending_role = guild_index.role(guild, PENDING_ROLE_NAME)
+        if pending_role is None:
+            continue
+        verified_role = guild_index.role(guild, VERIFIED_ROLE_NAME)
+        for member in guild.members:
+            scanned += 1
+            if scanned % 1000 == 0:
+                # 大服务器分段让出事件循环
+                await asyncio.sleep(0)
+            if member.get_role(pending_role.id) is None:
+                continue
+            # 已审核跳过
+            if verified_role and member.get_role(verified_role.id) is not None:
+                continue
+            if member.joined_at is None:
+                continue
+            if joined_after is not None and member.joined_at.timestamp() < joined_after:
+                continue
+            await _schedule_member_check_from_join(member)
+    return scanned
+
+async def restore_member_checks():
+    """恢复保存的成员检查计划；没有保存时扫描全部成员"""
+    data = await load_aux_state(MEMBER_CHECK_STATE)
+    if data is None:
+        print("没有保存的成员检查计划，扫描全部成员...")
+        scanned = await _scan_pending_members(bot.guilds)
+        print(f"扫描了 {scanned} 名成员")
+        return
+
+    for key, deadline in data.get("checks", {}).items():
+        guild_id, member_id = (int(x) for x in key.split(":"))
+        member_check_scheduler.schedule((guild_id, member_id), deadline)
+    print(f"恢复了 {len(member_check_scheduler)} 个成员检查计划")
 
-    async def _runner():
+    # 后台补上机器人离线期间加入的成员（留一分钟余量）
+    async def _catch_up():
         try:
-            await asyncio.sleep(max(0, delay_seconds))
-            await _kick_if_still_unverified_and_no_ticket(member)
-        finally:
-            _member_check_tasks.pop(key, None)
+            await _scan_pending_members(bot.guilds, joined_after=data.get("saved_at", 0) - 60)
+        except Exception as e:
+            print(f"补充离线期间加入的成员失败: {e}")
+
+    spawn_background(_catch_up())
 
-    task = asyncio.create_task(_runner())
-    _member_check_tasks[key] = task
+# --- 斜杠命令同步 ---
+# 同步是全局且限流严格的 API 调用，只在命令树（名称、描述、参数）变化时才执行
+COMMAND_SYNC_STATE = "command_sync"
+# 指定服务器ID后只同步到该服务器，可立即生效（适合测试服务器）
+COMMAND_SYNC_GUILD_ID = os.getenv("COMMAND_SYNC_GUILD_ID")
+
+def command_tree_fingerprint():
+    """计算命令树的稳定指纹"""
+    payload = []
+    for cmd in bot.tree.get_commands():
+        try:
+            payload.append(cmd.to_dict(bot.tree))
+        except TypeError:
+            # 旧版 discord.py 的 to_dict 不接收参数
+            payload.append(cmd.to_dict())
+    payload.sort(key=lambda d: (d.get("type", 1), d["name"]))
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+async def sync_command_tree(force=False):
+    """同步斜杠命令；命令树未变化且未强制时跳过并返回 None，否则返回同步结果"""
+    fingerprint = command_tree_fingerprint()
+    scope = f"guild:{COMMAND_SYNC_GUILD_ID}" if COMMAND_SYNC_GUILD_ID else "global"
+    if not force:
+        state = await load_aux_state(COMMAND_SYNC_STATE)
+        if state and state.get("fingerprint") == fingerprint and state.get("scope") == scope:
+            print(f"斜杠命令未变化（{fingerprint[:12]}），跳过同步")
+            return None
+
+    start = time.perf_counter()
+    if COMMAND_SYNC_GUILD_ID:
+        guild = discord.Object(id=int(COMMAND_SYNC_GUILD_ID))
+        bot.tree.copy_global_to(guild=guild)
+        synced = await bot.tree.sync(guild=guild)
+    else:
+        synced = await bot.tree.sync()
+    elapsed = time.perf_counter() - start
+    print(f"成功同步 {len(synced)} 条斜杠命令（{scope}），耗时 {elapsed:.2f} 秒")
+
+    try:
+        await save_aux_state(COMMAND_SYNC_STATE, {
+            "fingerprint": fingerprint,
+            "scope": scope,
+            "synced_at": datetime.now().isoformat()
+        })
+    except Exception as e:
+        print(f"保存命令同步记录失败: {e}")
+    return synced
 
 # --- Bot 事件 ---
+# on_ready 在断线重连后也会触发，启动初始化只执行一次
+_startup_done = False
+votes_loaded = False  # 启动时投票数据是否已加载（/healthz 使用）
+
 @bot.event
 async def on_ready():
-    global active_votes
+    global active_votes, _startup_done, votes_loaded
     print(f'机器人已登录，用户名为: {bot.user}')
+    if _startup_done:
+        print("重新连接，跳过启动初始化")
+        return
+    _startup_done = True
     
     # 加载投票数据
     print("正在加载投票数据...")
-    active_votes = await load_votes_data()
+    active_votes = use_compact_voters(await load_votes_data())
+    votes_loaded = True
     print(f"加载了 {len(active_votes)} 个投票数据")
     
     if active_votes:
         print("活跃投票列表:")
         for vote_id, vote_data in active_votes.items():
-            print(f"  - {vote_data['title']} (ID: {vote_id[-10:]})")
+            if vote_registry.register(vote_id, vote_data):
+                # 旧数据补充的短编号需要写回存储（journal 模式靠 update 记录保存，重启后编号不变）
+                vote_saver.mark_dirty(vote_id, {"op": "update", "id": vote_id,
+                                                "fields": {"short_id": vote_data["short_id"]}})
+            print(f"  - {vote_data['title']} (编号: {vote_data['short_id']}, ID: {vote_id[-10:]})")
+        if vote_saver.pending:
+            # 用户可能马上看到新分配的编号，立即写入，不等写回间隔
+            await vote_saver.flush()
     else:
         print("没有找到活跃投票数据")
     
@@ -496,39 +2820,21 @@ async def on_ready():
     bot.add_view(SuggestionView())
     bot.add_view(DeleteSuggestionView())
     try:
-        print("开始同步斜杠命令...")
-        synced = await bot.tree.sync()
-        print(f"成功同步 {len(synced)} 条斜杠命令。")
-        for cmd in synced:
+        print("检查斜杠命令是否需要同步...")
+        synced = await sync_command_tree()
+        for cmd in synced or []:
             print(f"  - {cmd.name}: {cmd.description}")
     except Exception as e:
         print(f"同步命令时发生错误: {e}")
-        import traceback
         traceback.print_exc()
 
-    # 启动时对现有成员做一次排查与调度
+    # 加载成员工单活跃索引（后台补全未索引的工单频道）
+    await ticket_activity.start(bot.guilds)
+
+    # 恢复成员检查计划
     try:
-        for guild in bot.guilds:
-            pending_role = discord.utils.get(guild.roles, name=PENDING_ROLE_NAME)
-            if pending_role is None:
-                continue
-            for member in guild.members:
-                if pending_role not in member.roles:
-                    continue
-                # 已审核跳过
-                verified_role = discord.utils.get(guild.roles, name=VERIFIED_ROLE_NAME)
-                if verified_role and verified_role in member.roles:
-                    continue
-                # 计算已加入时长
-                if member.joined_at is None:
-                    continue
-                # Discord 的 joined_at 是UTC时间
-                now = discord.utils.utcnow()
-                elapsed = (now - member.joined_at).total_seconds()
-                if elapsed >= CHECK_DELAY_SECONDS:
-                    await _schedule_member_check(member, 0)
-                else:
-                    await _schedule_member_check(member, int(CHECK_DELAY_SECONDS - elapsed))
+        await restore_member_checks()
+        print(f"成员检查队列: {member_check_scheduler.stats()}")
     except Exception as e:
         print(f"启动检查时发生错误: {e}")
 
@@ -549,7 +2855,7 @@ class ConfirmSuggestionView(discord.ui.View):
     async def create_suggestion_channel(self, interaction: discord.Interaction):
         try:
             # 获取建议分类
-            suggestion_category = interaction.guild.get_channel(SUGGESTION_CATEGORY_ID)
+            suggestion_category = guild_index.channel(SUGGESTION_CATEGORY_ID, interaction.guild)
             if not suggestion_category:
                 await interaction.response.send_message("❌ 错误：找不到建议分类！", ephemeral=True)
                 return
@@ -570,7 +2876,7 @@ class ConfirmSuggestionView(discord.ui.View):
             channel_name = f"建议-{next_number:04d}"
             
             # 获取管理组角色
-            staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
+            staff_role = guild_index.role(interaction.guild, STAFF_ROLE_NAME)
             if not staff_role:
                 await interaction.response.send_message("❌ 错误：找不到管理组角色！", ephemeral=True)
                 return
@@ -599,9 +2905,7 @@ class ConfirmSuggestionView(discord.ui.View):
             await interaction.response.send_message(f"✅ 建议频道已创建，点击此链接跳转：{suggestion_channel.mention}", ephemeral=True)
             
             # 记录日志
-            log_channel = bot.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                await log_channel.send(f"{interaction.user.mention} 创建了建议频道：{suggestion_channel.mention}")
+            log_sink.write(f"{interaction.user.mention} 创建了建议频道：{suggestion_channel.mention}")
                 
         except Exception as e:
             await interaction.response.send_message(f"❌ 创建建议频道时发生错误：{e}", ephemeral=True)
@@ -622,12 +2926,14 @@ class SuggestionView(discord.ui.View):
 
 # --- 斜杠命令 ---
 @bot.tree.command(name="投票", description="创建一个新的投票")
+@timed_handler("command.投票")
 async def create_vote(
     interaction: discord.Interaction, 
     投票名称: str,
     选项: str,
     结束时间_小时: int,
-    投票身份组: str = "@everyone"
+    投票身份组: str = "@everyone",
+    实时结果: bool = False
 ):
     """创建投票
     
@@ -636,11 +2942,11 @@ async def create_vote(
     - 选项: 用逗号分隔的选项，例如：选项1,选项2,选项3
     - 结束时间_小时: 投票持续多少小时
     - 投票身份组: 哪个身份组可以投票，默认所有人
+    - 实时结果: 是否在投票消息上实时显示票数，默认不显示
     """
     try:
         # 检查权限
-        staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
-        if not staff_role or staff_role not in interaction.user.roles:
+        if not is_staff(interaction.user):
             await interaction.response.send_message("❌ 权限不足：只有管理组可以创建投票！", ephemeral=True)
             return
         
@@ -656,7 +2962,7 @@ async def create_vote(
         
         # 检查身份组
         if 投票身份组 != "@everyone":
-            role = discord.utils.get(interaction.guild.roles, name=投票身份组)
+            role = guild_index.role(interaction.guild, 投票身份组)
             if not role:
                 await interaction.response.send_message(f"❌ 找不到身份组：{投票身份组}", ephemeral=True)
                 return
@@ -674,25 +2980,35 @@ async def create_vote(
             "title": 投票名称,
             "options": options,
             "votes": [0] * len(options),
-            "voters": {},
+            "voters": VoterStore(),
             "allowed_role": 投票身份组,
             "creator": str(interaction.user),
             "channel_id": interaction.channel.id,
             "guild_id": interaction.guild.id,
-            "end_time": end_time.isoformat()
+            "end_time": end_time.isoformat(),
+            "live_results": 实时结果
         }
+        vote_registry.register(vote_id, active_votes[vote_id])
+        # 标记修改，由后台合并写入（需在任何投票记录之前）
+        vote_saver.mark_dirty(vote_id, {
+            "op": "create", "id": vote_id,
+            "vote": dict(active_votes[vote_id], votes=[0] * len(options), voters={})
+        })
         
         # 创建投票视图
-        vote_view = VoteView(vote_id, options, 投票身份组, end_time)
+        vote_view = build_vote_view(vote_id, options)
         
         # 创建投票消息
-        vote_text = f"🗳️ **{投票名称}**\n\n"
-        vote_text += f"结束时间：<t:{int(end_time.timestamp())}:F>\n"
-        vote_text += f"可投票身份组：{投票身份组}\n\n"
-        vote_text += "请点击下方按钮进行投票："
+        vote_text = render_vote_message(active_votes[vote_id])
         
         await interaction.response.send_message(vote_text, view=vote_view)
         
+        if 实时结果:
+            # 记下消息ID，之后由 live_tally 编辑这条消息
+            message = await interaction.original_response()
+            active_votes[vote_id]["message_id"] = message.id
+            vote_saver.mark_dirty(vote_id, {"op": "update", "id": vote_id, "fields": {"message_id": message.id}})
+        
         # 安排结束任务
         async def end_vote_task():
             await asyncio.sleep(结束时间_小时 * 3600)
@@ -701,24 +3017,19 @@ async def create_vote(
         task = asyncio.create_task(end_vote_task())
         vote_tasks[vote_id] = task
         
-        # 保存到存储
-        await save_votes_data()
-        
         # 记录日志
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"{interaction.user.mention} 创建了投票：{投票名称}")
+        log_sink.write(f"{interaction.user.mention} 创建了投票：{投票名称}")
             
     except Exception as e:
         await interaction.response.send_message(f"❌ 创建投票时发生错误：{e}", ephemeral=True)
 
 @bot.tree.command(name="投票状态", description="查看投票的实时状态（仅管理可用）")
+@timed_handler("command.投票状态")
 async def vote_status(interaction: discord.Interaction, 投票编号: str = None):
     """查看投票状态"""
     try:
         # 检查权限
-        staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
-        if not staff_role or staff_role not in interaction.user.roles:
+        if not is_staff(interaction.user):
             await interaction.response.send_message("❌ 权限不足：只有管理组可以查看投票状态！", ephemeral=True)
             return
         
@@ -729,10 +3040,10 @@ async def vote_status(interaction: discord.Interaction, 投票编号: str = None
         # 如果没有指定投票编号，显示所有投票
         if not 投票编号:
             vote_list = []
-            for vid, vdata in active_votes.items():
-                if vdata["guild_id"] == interaction.guild.id:
-                    end_time = datetime.fromisoformat(vdata["end_time"])
-                    vote_list.append(f"• {vdata['title']} (ID: {vid[-10:]})")
+            for short_id, vid in vote_registry.votes_in(interaction.guild.id).items():
+                vdata = active_votes.get(vid)
+                if vdata is not None:
+                    vote_list.append(f"• {vdata['title']} (编号: {short_id})")
             
             if not vote_list:
                 await interaction.response.send_message("❌ 此服务器没有进行中的投票！", ephemeral=True)
@@ -744,11 +3055,8 @@ async def vote_status(interaction: discord.Interaction, 投票编号: str = None
             return
         
         # 查找指定投票
-        target_vote = None
-        for vid, vdata in active_votes.items():
-            if vid.endswith(投票编号) and vdata["guild_id"] == interaction.guild.id:
-                target_vote = (vid, vdata)
-                break
+        vid = vote_registry.resolve(interaction.guild.id, 投票编号)
+        target_vote = (vid, active_votes[vid]) if vid in active_votes else None
         
         if not target_vote:
             await interaction.response.send_message(f"❌ 找不到投票编号：{投票编号}", ephemeral=True)
@@ -770,29 +3078,14 @@ async def vote_status(interaction: discord.Interaction, 投票编号: str = None
         if vdata["voters"]:
             status_text += "\n**投票详情：**\n"
             
-            # 按选项分组收集投票者
-            option_voters = {}
-            for user_id, vote_info in vdata["voters"].items():
-                option_index = vote_info["option"]
-                if option_index not in option_voters:
-                    option_voters[option_index] = []
-                option_voters[option_index].append(vote_info)
-            
-            # 为每个选项显示最后10个投票者
+            # 为每个选项显示最后10个投票者（最新的在前）
+            buffers = recent_voter_buffers(vid, vdata)
             for i, option in enumerate(vdata["options"]):
-                if i in option_voters:
-                    voters = option_voters[i]
-                    # 按时间排序，取最后10个
-                    voters.sort(key=lambda x: x.get('time', ''), reverse=True)
-                    recent_voters = voters[:10]
-                    
+                if buffers[i]:
                     status_text += f"\n**{option}** (最后10个投票者):\n"
-                    if recent_voters:
-                        for vote_info in recent_voters:
-                            user_name = vote_info['user'][:15] + "..." if len(vote_info['user']) > 15 else vote_info['user']
-                            status_text += f"• {user_name}\n"
-                    else:
-                        status_text += "• 暂无投票者\n"
+                    for user in reversed(buffers[i]):
+                        user_name = user[:15] + "..." if len(user) > 15 else user
+                        status_text += f"• {user_name}\n"
         
         # 检查消息长度，如果超过1900字符就分割
         if len(status_text) > 1900:
@@ -825,6 +3118,7 @@ async def vote_status(interaction: discord.Interaction, 投票编号: str = None
         await interaction.response.send_message(f"❌ 查看投票状态时发生错误：{e}", ephemeral=True)
 
 @bot.tree.command(name="删除投票", description="删除或提前结束投票（仅管理可用）")
+@timed_handler("command.删除投票")
 async def delete_vote(interaction: discord.Interaction, 投票编号: str, 是否公布结果: bool = True):
     """删除投票
     
@@ -834,17 +3128,13 @@ async def delete_vote(interaction: discord.Interaction, 投票编号: str, 是
     """
     try:
         # 检查权限
-        staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
-        if not staff_role or staff_role not in interaction.user.roles:
+        if not is_staff(interaction.user):
             await interaction.response.send_message("❌ 权限不足：只有管理组可以删除投票！", ephemeral=True)
             return
         
         # 查找投票
-        target_vote = None
-        for vid, vdata in active_votes.items():
-            if vid.endswith(投票编号) and vdata["guild_id"] == interaction.guild.id:
-                target_vote = (vid, vdata)
-                break
+        vid = vote_registry.resolve(interaction.guild.id, 投票编号)
+        target_vote = (vid, active_votes[vid]) if vid in active_votes else None
         
         if not target_vote:
             await interaction.response.send_message(f"❌ 找不到投票编号：{投票编号}", ephemeral=True)
@@ -863,32 +3153,52 @@ async def delete_vote(interaction: discord.Interaction, 投票编号: str, 是
             await end_vote(vid, vdata["channel_id"], vdata["guild_id"])
             
             # 记录日志
-            log_channel = bot.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                await log_channel.send(f"{interaction.user.mention} 提前结束了投票：{vdata['title']}")
+            log_sink.write(f"{interaction.user.mention} 提前结束了投票：{vdata['title']}")
         else:
             # 直接删除不公布结果
+            await live_tally.finish(vid, final_edit=False)
             active_votes.pop(vid, None)
+            _recent_voters.pop(vid, None)
+            vote_registry.unregister(vid, vdata)
+            vote_saver.mark_dirty(vid, {"op": "end", "id": vid})
+            # 先回复再写入：远程存储可能超过交互的 3 秒响应期限
             await interaction.response.send_message(f"✅ 投票「{vdata['title']}」已删除，未公布结果。", ephemeral=True)
             
             # 记录日志
-            log_channel = bot.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                await log_channel.send(f"{interaction.user.mention} 删除了投票（未公布结果）：{vdata['title']}")
-        
-        # 保存到存储
-        await save_votes_data()
+            log_sink.write(f"{interaction.user.mention} 删除了投票（未公布结果）：{vdata['title']}")
+            await vote_saver.flush(respect_window=True)
                 
     except Exception as e:
-        await interaction.response.send_message(f"❌ 删除投票时发生错误：{e}", ephemeral=True)
+        if interaction.response.is_done():
+            await interaction.followup.send(f"❌ 删除投票时发生错误：{e}", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"❌ 删除投票时发生错误：{e}", ephemeral=True)
+
+@vote_status.autocomplete("投票编号")
+@delete_vote.autocomplete("投票编号")
+async def vote_id_autocomplete(interaction: discord.Interaction, current: str):
+    """根据编号前缀或标题关键字补全投票编号（最新的在前）"""
+    current = current.strip().lstrip('#').lower()
+    choices = []
+    votes = vote_registry.votes_in(interaction.guild_id)
+    for short_id, vid in sorted(votes.items(), key=lambda item: -int(item[0]) if item[0].isdigit() else 0):
+        vdata = active_votes.get(vid)
+        if vdata is None:
+            continue
+        if current and not short_id.startswith(current) and current not in vdata["title"].lower():
+            continue
+        choices.append(app_commands.Choice(name=f"{short_id} · {vdata['title']}"[:100], value=short_id))
+        if len(choices) >= 25:
+            break
+    return choices
 
 @bot.tree.command(name="公告", description="发送公告消息和建议提交按钮")
+@timed_handler("command.公告")
 async def announcement(interaction: discord.Interaction, 内容: str):
     """发送公告并添加建议提交按钮"""
     try:
         # 检查权限
-        staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
-        if not staff_role or staff_role not in interaction.user.roles:
+        if not is_staff(interaction.user):
             await interaction.response.send_message("❌ 权限不足：只有管理组可以使用此命令！", ephemeral=True)
             return
         
@@ -901,20 +3211,18 @@ async def announcement(interaction: discord.Interaction, 内容: str):
         await interaction.response.send_message(announcement_text, view=view)
         
         # 记录日志
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"{interaction.user.mention} 发布了公告")
+        log_sink.write(f"{interaction.user.mention} 发布了公告")
             
     except Exception as e:
         await interaction.response.send_message(f"❌ 发送公告时发生错误：{e}", ephemeral=True)
 
 @bot.tree.command(name="编辑公告", description="编辑已发送的公告消息")
+@timed_handler("command.编辑公告")
 async def edit_announcement(interaction: discord.Interaction, message_id: str, new_content: str):
     """编辑公告消息"""
     try:
         # 检查权限
-        staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
-        if not staff_role or staff_role not in interaction.user.roles:
+        if not is_staff(interaction.user):
             await interaction.response.send_message("❌ 权限不足：只有管理组可以编辑公告！", ephemeral=True)
             return
         
@@ -939,20 +3247,18 @@ async def edit_announcement(interaction: discord.Interaction, message_id: str, n
         await interaction.response.send_message(f"✅ 公告已更新！", ephemeral=True)
         
         # 记录日志
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"{interaction.user.mention} 编辑了公告消息 (ID: {message_id})")
+        log_sink.write(f"{interaction.user.mention} 编辑了公告消息 (ID: {message_id})")
             
     except Exception as e:
         await interaction.response.send_message(f"❌ 编辑公告时发生错误：{e}", ephemeral=True)
 
 @bot.tree.command(name="删除公告", description="删除已发送的公告消息")
+@timed_handler("command.删除公告")
 async def delete_announcement(interaction: discord.Interaction, message_id: str):
     """删除公告消息"""
     try:
         # 检查权限
-        staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
-        if not staff_role or staff_role not in interaction.user.roles:
+        if not is_staff(interaction.user):
             await interaction.response.send_message("❌ 权限不足：只有管理组可以删除公告！", ephemeral=True)
             return
         
@@ -974,42 +3280,76 @@ async def delete_announcement(interaction: discord.Interaction, message_id: str)
         await interaction.response.send_message(f"✅ 公告已删除！", ephemeral=True)
         
         # 记录日志
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"{interaction.user.mention} 删除了公告消息 (ID: {message_id})")
+        log_sink.write(f"{interaction.user.mention} 删除了公告消息 (ID: {message_id})")
             
     except Exception as e:
         await interaction.response.send_message(f"❌ 删除公告时发生错误：{e}", ephemeral=True)
 
 @bot.tree.command(name="同步命令", description="强制同步斜杠命令（仅管理可用）")
+@timed_handler("command.同步命令")
 async def sync_commands(interaction: discord.Interaction):
     """强制同步命令"""
     try:
         # 检查权限
-        staff_role = discord.utils.get(interaction.guild.roles, name=STAFF_ROLE_NAME)
-        if not staff_role or staff_role not in interaction.user.roles:
+        if not is_staff(interaction.user):
             await interaction.response.send_message("❌ 权限不足：只有管理组可以同步命令！", ephemeral=True)
             return
         
         await interaction.response.send_message("🔄 正在同步命令...", ephemeral=True)
         
-        synced = await bot.tree.sync()
+        synced = await sync_command_tree(force=True)
         await interaction.edit_original_response(content=f"✅ 成功同步 {len(synced)} 条斜杠命令！")
         
         # 记录日志
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"{interaction.user.mention} 手动同步了 {len(synced)} 条斜杠命令")
+        log_sink.write(f"{interaction.user.mention} 手动同步了 {len(synced)} 条斜杠命令")
             
     except Exception as e:
         await interaction.edit_original_response(content=f"❌ 同步命令时发生错误：{e}")
 
+@bot.tree.command(name="性能报告", description="查看事件循环延迟和最慢的处理（仅管理可用）")
+@timed_handler("command.性能报告")
+async def performance_report(interaction: discord.Interaction, 显示调用栈: bool = False):
+    """查看性能报告
+    
+    参数:
+    - 显示调用栈: 是否附上最慢一次事件循环阻塞的调用栈
+    """
+    if not is_staff(interaction.user):
+        await interaction.response.send_message("❌ 权限不足：只有管理组可以查看性能报告！", ephemeral=True)
+        return
+    
+    lines = ["⏱️ **性能报告**\n"]
+    lines.append(f"事件循环延迟：当前 {loop_lag.last * 1000:.0f}ms，最近最高 {loop_lag.recent_max() * 1000:.0f}ms，启动以来最高 {loop_lag.max * 1000:.0f}ms")
+    top = slow_calls.top()
+    if not top:
+        lines.append("\n没有记录到慢调用 ✅")
+    else:
+        lines.append(f"\n**最慢的 {len(top)} 次调用：**")
+        for i, r in enumerate(top, 1):
+            kind = "阻塞" if r["kind"] == "loop" else "处理"
+            lines.append(f"{i}. [{kind}] `{r['name']}` {r['ms']:.0f}ms（{r['at']}）")
+    text = "\n".join(lines)[:DISCORD_MESSAGE_LIMIT]
+    
+    if 显示调用栈:
+        stack = next((r["stack"] for r in top if r["stack"]), None)
+        if stack:
+            # 只截断调用栈（保留最内层的帧），代码块始终完整闭合
+            room = max(0, DISCORD_MESSAGE_LIMIT - len(text) - len("\n```\n\n```"))
+            if room >= 100:
+                text += f"\n```\n{stack[-room:]}\n```"
+            else:
+                text = text[:DISCORD_MESSAGE_LIMIT - 30] + "\n（内容过长，未附调用栈）"
+    
+    await interaction.response.send_message(text, ephemeral=True)
+
 @bot.tree.command(name="测试", description="测试命令是否正常工作")
+@timed_handler("command.测试")
 async def test_command(interaction: discord.Interaction):
     """测试命令"""
     await interaction.response.send_message("✅ 测试命令正常工作！", ephemeral=True)
 
 @bot.tree.command(name="回顶", description="回到当前帖子或讨论串的顶部")
+@timed_handler("command.回顶")
 async def top(interaction: discord.Interaction):
     # 1. 检查是否为特殊频道
     if interaction.channel.id == SPECIAL_TOP_CHANNEL_ID:
@@ -1032,105 +3372,190 @@ async def top(interaction: discord.Interaction):
 
 @bot.event
 async def on_member_join(member: discord.Member):
+    event_recorder.member_join(member)
     try:
         # 对新成员设置48小时检查
         await _schedule_member_check(member, CHECK_DELAY_SECONDS)
     except Exception as e:
         print(f"为新成员调度检查时发生错误: {e}")
 
-# --- 消息监听与审核逻辑 ---
 @bot.event
-async def on_message(message):
-    if message.author.bot or not message.guild:
-        return
+async def on_interaction(interaction: discord.Interaction):
+    # 只用于事件录制，交互本身仍由命令树和按钮处理
+    event_recorder.interaction(interaction)
 
-    if not message.channel.name.startswith(TICKET_CHANNEL_PREFIX):
-        return
-        
-    staff_role = discord.utils.get(message.guild.roles, name=STAFF_ROLE_NAME)
-    if not staff_role or staff_role not in message.author.roles:
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    # 身份组变化时增量维护检查计划
+    if before.roles == after.roles:
         return
+    try:
+        if _needs_member_check(after):
+            if not _needs_member_check(before):
+                await _schedule_member_check_from_join(after)
+        else:
+            _cancel_member_check(after.guild.id, after.id)
+    except Exception as e:
+        print(f"更新成员检查计划时发生错误: {e}")
 
-    if VERIFY_KEYWORDS_PATTERN.search(message.content):
-        try:
-            ticket_creator = None
-            async for old_message in message.channel.history(limit=10, oldest_first=True):
-                if old_message.author.bot and old_message.mentions:
-                    ticket_creator = old_message.mentions[0]
-                    break 
-
-            if not ticket_creator:
-                await message.channel.send("❌ 错误：无法在此工单中自动识别开票人。")
-                return
+@bot.event
+async def on_member_remove(member: discord.Member):
+    _cancel_member_check(member.guild.id, member.id)
 
-            verified_role = discord.utils.get(message.guild.roles, name=VERIFIED_ROLE_NAME)
-            pending_role = discord.utils.get(message.guild.roles, name=PENDING_ROLE_NAME)
-            if not verified_role:
-                await message.channel.send(f"❌ 错误：找不到 `{VERIFIED_ROLE_NAME}` 身份组！")
+@bot.event
+async def on_guild_channel_create(channel):
+    # 新建的工单频道，等待机器人的开票提示
+    if isinstance(channel, discord.TextChannel) and channel.name.startswith(TICKET_CHANNEL_PREFIX):
+        _fresh_ticket_channels.add(channel.id)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    forget_ticket_channel(channel.id)
+    guild_index.forget_channel(channel.id)
+
+@bot.event
+async def on_guild_role_create(role):
+    guild_index.rebuild_roles(role.guild)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name or before.position != after.position:
+        guild_index.rebuild_roles(after.guild)
+
+@bot.event
+async def on_guild_role_delete(role):
+    guild_index.rebuild_roles(role.guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    guild_index.forget_guild(guild.id)
+
+# --- 消息监听与审核逻辑 ---
+@timed_handler("on_message.verify")
+async def handle_ticket_verify(message):
+    """管理员在工单中发送审核关键词：给开票人加已审核身份组并归档工单
+
+    找到开票人后先用一次 member.edit 替换身份组；成功后确认消息（附删除按钮）、日志
+    与频道移动/重命名并发执行。身份组替换失败时工单保持原样，不归档。
+    各步骤耗时记录在 verify.* 指标中。
+    """
+    try:
+        with handler_timer("verify.owner"):
+            ticket_creator = await get_ticket_owner(message.channel)
+
+        if not ticket_creator:
+            await message.channel.send("❌ 错误：无法在此工单中自动识别开票人。")
+            return
+
+        verified_role = guild_index.role(message.guild, VERIFIED_ROLE_NAME)
+        pending_role = guild_index.role(message.guild, PENDING_ROLE_NAME)
+        if not verified_role:
+            await message.channel.send(f"❌ 错误：找不到 `{VERIFIED_ROLE_NAME}` 身份组！")
+            return
+
+        ticket_number = message.channel.name.split('-')[-1]
+        admin_user = message.author
+
+        # 在当前身份组基础上加已审核、去待审核，一次请求完成（原来是 add_roles + remove_roles 两次）。
+        # 必须先于归档完成：归档后的频道不再算作工单，身份组没换成功的成员会在到期检查时被踢出
+        has_verified = ticket_creator.get_role(verified_role.id) is not None
+        has_pending = pending_role is not None and ticket_creator.get_role(pending_role.id) is not None
+        if has_pending or not has_verified:
+            new_roles = [role for role in ticket_creator.roles
+                         if not role.is_default() and (pending_role is None or role.id != pending_role.id)]
+            if not has_verified:
+                new_roles.append(verified_role)
+            try:
+                with handler_timer("verify.roles"):
+                    await ticket_creator.edit(roles=new_roles, reason=f"管理员 {admin_user.display_name} 审核通过")
+            except discord.HTTPException as e:
+                await message.channel.send(
+                    f"❌ 修改 {ticket_creator.mention} 的身份组失败，工单未归档：{e}\n"
+                    f"请确保机器人拥有 **管理身份组** 的权限，并且其身份组层级高于目标用户。")
                 return
-            
-            await ticket_creator.add_roles(verified_role)
-            if pending_role and pending_role in ticket_creator.roles:
-                await ticket_creator.remove_roles(pending_role)
 
-            archive_category = message.guild.get_channel(ARCHIVE_CATEGORY_ID)
+        async def confirm():
+            with handler_timer("verify.confirm"):
+                await message.channel.send(
+                    f"✅ 用户 {ticket_creator.mention} 已审核通过。\n请点击下方的按钮删除此工单：",
+                    view=DeleteTicketView())
+
+            log_msg = f"工单 `ticket-{ticket_number}`: 管理员 **{admin_user.display_name}** 审核了用户 {ticket_creator.mention} ({ticket_creator})。"
+            log_sink.write(log_msg)
+            if not get_log_channel():
+                print(f"错误：找不到ID为 {LOG_CHANNEL_ID} 的日志频道。")
+                await message.channel.send(f"⚠️ **管理员请注意**: 未能找到日志频道，本次操作仅记录在控制台。")
+
+        async def archive():
+            archive_category = guild_index.channel(ARCHIVE_CATEGORY_ID, message.guild)
             if archive_category and isinstance(archive_category, discord.CategoryChannel):
                 new_name = message.channel.name.replace('ticket-', 'closed-', 1)
-                await message.channel.edit(name=new_name, category=archive_category)
+                with handler_timer("verify.archive"):
+                    await message.channel.edit(name=new_name, category=archive_category)
             else:
                 await message.channel.send(f"⚠️ **管理员请注意**: 未能找到归档类别，频道未移动。")
 
-            await message.channel.send(f"✅ 用户 {ticket_creator.mention} 已审核通过。")
-            await message.channel.send("请点击下方的按钮删除此工单：", view=DeleteTicketView())
+        await asyncio.gather(confirm(), archive())
+    except Exception as e:
+        await message.channel.send(f"执行审核操作时发生未知错误: {e}")
 
-            log_channel = bot.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                ticket_number = message.channel.name.split('-')[-1]
-                admin_user = message.author
-                log_msg = f"工单 `ticket-{ticket_number}`: 管理员 **{admin_user.display_name}** 审核了用户 {ticket_creator.mention} ({ticket_creator})。"
-                await log_channel.send(log_msg)
-            else:
-                print(f"错误：找不到ID为 {LOG_CHANNEL_ID} 的日志频道。")
-                await message.channel.send(f"⚠️ **管理员请注意**: 未能找到日志频道，本次操作未记录。")
-        except Exception as e:
-            await message.channel.send(f"执行审核操作时发生未知错误: {e}")
 
+@timed_handler("on_message.kick")
+async def handle_ticket_kick(message):
+    """管理员在工单中发送踢出关键词：踢出开票人并删除工单"""
+    try:
+        # 查找开票人
+        ticket_creator = await get_ticket_owner(message.channel)
 
-    elif message.content == KICK_KEYWORD:
-        try:
-            # 查找开票人
-            ticket_creator = None
-            async for old_message in message.channel.history(limit=10, oldest_first=True):
-                if old_message.author.bot and old_message.mentions:
-                    ticket_creator = old_message.mentions[0]
-                    break 
-
-            if not ticket_creator:
-                await message.channel.send("❌ 错误：无法在此工单中自动识别开票人。")
-                return
+        if not ticket_creator:
+            await message.channel.send("❌ 错误：无法在此工单中自动识别开票人。")
+            return
 
-            admin_user = message.author
-            kick_reason = f"由管理员 {admin_user.display_name} 在工单频道 {message.channel.name} 中操作"
-            
-            # 执行踢人操作
-            await ticket_creator.kick(reason=kick_reason)
-            
-            # 发送频道内通知
-            await message.channel.send(f"✅ 操作成功！用户 {ticket_creator.mention} 已被踢出服务器。")
-            
-            # 发送日志
-            log_channel = bot.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                ticket_number = message.channel.name.split('-')[-1]
-                log_msg = f"工单 `ticket-{ticket_number}`: 管理员 **{admin_user.display_name}** 已将用户 {ticket_creator.mention} ({ticket_creator}) **踢出服务器**。"
-                await log_channel.send(log_msg)
+        admin_user = message.author
+        kick_reason = f"由管理员 {admin_user.display_name} 在工单频道 {message.channel.name} 中操作"
 
-            await message.channel.delete()
+        # 执行踢人操作
+        await ticket_creator.kick(reason=kick_reason)
 
-        except discord.Forbidden:
-            await message.channel.send(f"❌ 权限错误！请确保机器人拥有 **踢出成员** 的权限，并且其身份组层级高于目标用户。")
-        except Exception as e:
-            await message.channel.send(f"发生未知错误: {e}")
+        # 发送频道内通知
+        await message.channel.send(f"✅ 操作成功！用户 {ticket_creator.mention} 已被踢出服务器。")
+
+        # 发送日志
+        ticket_number = message.channel.name.split('-')[-1]
+        log_msg = f"工单 `ticket-{ticket_number}`: 管理员 **{admin_user.display_name}** 已将用户 {ticket_creator.mention} ({ticket_creator}) **踢出服务器**。"
+        log_sink.write(log_msg)
+
+        await message.channel.delete()
+
+    except discord.Forbidden:
+        await message.channel.send(f"❌ 权限错误！请确保机器人拥有 **踢出成员** 的权限，并且其身份组层级高于目标用户。")
+    except Exception as e:
+        await message.channel.send(f"发生未知错误: {e}")
+
+
+@bot.event
+@timed_handler("on_message")
+async def on_message(message):
+    if not message.guild:
+        return
+    event_recorder.message(message)
+    if message.author.bot:
+        remember_ticket_owner(message)
+        return
+
+    if not message.channel.name.startswith(TICKET_CHANNEL_PREFIX):
+        return
+
+    # 更新成员工单活跃索引
+    ticket_activity.record_message(message)
+        
+    if not is_staff(message.author):
+        return
+
+    if VERIFY_KEYWORDS_PATTERN.search(message.content):
+        await handle_ticket_verify(message)
+    elif message.content == KICK_KEYWORD:
+        await handle_ticket_kick(message)
 
 
 # --- 运行 Bot ---
@@ -1156,10 +3581,13 @@ if __name__ == "__main__":
         if missing:
             print(f"⚠️ 警告：Cloudflare KV 配置不完整，缺少: {', '.join(missing)}")
     
-    # 创建并启动 Flask 服务器线程
-    print("🌐 启动 Flask 服务器...")
-    flask_thread = Thread(target=run_flask)
-    flask_thread.start()
+    if KEEPALIVE_SERVER == "flask":
+        # 创建并启动 Flask 服务器线程
+        print("🌐 启动 Flask 服务器...")
+        flask_thread = Thread(target=run_flask)
+        flask_thread.start()
+    else:
+        print("🌐 Web 服务将随机器人在事件循环中启动")
 
     # 运行机器人
     print("🤖 启动 Discord 机器人...")
@@ -1167,5 +3595,4 @@ if __name__ == "__main__":
         bot.run(bot_token)
     except Exception as e:
         print(f"❌ 机器人启动失败: {e}")
-        import traceback
         traceback.print_exc()
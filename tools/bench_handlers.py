@@ -0,0 +1,279 @@
+"""用替身 Discord 对象离线测量机器人处理函数的开销
+
+    python -m tools.bench_handlers                          # 运行全部场景
+    python -m tools.bench_handlers -s vote_clicks -s vote_status
+    python -m tools.bench_handlers -o results.json          # 保存结果
+    python -m tools.bench_handlers --compare results.json   # 与之前的结果对比
+
+每个场景报告吞吐量、单次操作 p50/p99 延迟、模拟的 REST 调用次数和 tracemalloc 峰值内存。
+投票数据写入临时目录（file 存储），不会影响真实数据。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from tools.fakes import FakeInteraction, FakeMessage, RestCounter, build_ticket_guild  # noqa: E402
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Run:
+    """单个场景的计时与计数"""
+
+    def __init__(self, rest):
+        self.rest = rest
+        self.samples = []
+
+    async def timed(self, coro):
+        start = time.perf_counter()
+        await coro
+        self.samples.append(time.perf_counter() - start)
+
+
+def reset_app_state(tmpdir):
+    """清空机器人的全局状态，投票改写到临时目录"""
+    app.STORAGE_TYPE = "file"
+    app.VOTES_DATA_FILE = os.path.join(tmpdir, "votes_data.json")
+    app.active_votes = {}
+    app._recent_voters.clear()
+    app.vote_registry = app.VoteRegistry()
+    app.ticket_activity = app.TicketActivityIndex()
+    app._ticket_owner_cache.clear()
+    app._fresh_ticket_channels.clear()
+    app.guild_index = app.GuildIndex()
+    app.member_check_scheduler = app.TimerScheduler("member_checks", app._run_member_check)
+
+
+def attach_log_channel(guild):
+    """让日志频道指向替身频道（日志只进入 log_sink 队列，不计 REST 调用）"""
+    guild.add_text_channel("日志", channel_id=app.LOG_CHANNEL_ID)
+    # get_log_channel() 不带服务器查找，先通过服务器写入索引缓存
+    return app.guild_index.channel(app.LOG_CHANNEL_ID, guild)
+
+
+def add_vote(guild, channel, options=("赞成", "反对", "弃权", "再议"), voters=0):
+    vote_id = f"{guild.id}_{channel.id}_{int(time.time())}"
+    vote_data = {
+        "title": "基准测试投票",
+        "options": list(options),
+        "votes": [0] * len(options),
+        "voters": app.VoterStore(),
+        "allowed_role": "@everyone",
+        "creator": "bench",
+        "channel_id": channel.id,
+        "guild_id": guild.id,
+        "end_time": (datetime.now() + timedelta(hours=24)).isoformat(),
+        "live_results": False,
+    }
+    now = time.time()
+    for i, member in enumerate(guild.members[:voters]):
+        option = i % len(options)
+        vote_data["votes"][option] += 1
+        vote_data["voters"].add(member.id, option, str(member), now)
+    app.active_votes[vote_id] = vote_data
+    app.vote_registry.register(vote_id, vote_data)
+    return vote_id, vote_data
+
+
+# --- 场景 ---
+
+async def scenario_vote_clicks(scale):
+    """N 个成员在 60 秒内依次点击投票按钮（按时间表均匀到达，时间按 speed 压缩）"""
+    voters = int(10000 * scale)
+    duration = 60.0
+    speed = 60.0  # 60 秒的到达时间表压缩到约 1 秒
+    rest = RestCounter()
+    guild, _, _ = build_ticket_guild(members=voters, rest=rest)
+    channel = guild.add_text_channel("投票")
+    vote_id, _ = add_vote(guild, channel)
+    members = guild.members[:voters]
+    run = Run(rest)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = []
+    for i, member in enumerate(members):
+        due = start + (i * duration / voters) / speed
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        interaction = FakeInteraction(member, channel)
+        option = i % 4
+        tasks.append(asyncio.create_task(run.timed(app.handle_vote_click(interaction, vote_id, option))))
+    await asyncio.gather(*tasks)
+    # 投票结束前的一次写入
+    await run.timed(app.save_votes_data([vote_id], voters))
+    return run, voters
+
+
+async def scenario_startup_scan(scale):
+    """冷启动：500 个工单频道建立索引，2000 个待审核成员安排检查"""
+    tickets = int(500 * scale)
+    pending = int(2000 * scale)
+    rest = RestCounter()
+    guild, _, _ = build_ticket_guild(members=pending * 2, pending=pending, tickets=tickets, rest=rest)
+    run = Run(rest)
+
+    index = app.ticket_activity
+    original_scan = index.scan_channel
+
+    async def timed_scan(channel):
+        await run.timed(original_scan(channel))
+
+    index.scan_channel = timed_scan
+    await index.rebuild([guild])
+    await app._scan_pending_members([guild])
+    assert len(app.member_check_scheduler) == pending, len(app.member_check_scheduler)
+    return run, tickets
+
+
+async def scenario_vote_status(scale):
+    """对 20k 投票者的投票反复执行 /投票状态（首次包括最近投票者缓冲区的重建）"""
+    voters = int(20000 * scale)
+    iterations = 200
+    rest = RestCounter()
+    guild, staff, _ = build_ticket_guild(members=voters, rest=rest)
+    channel = guild.add_text_channel("投票")
+    _, vote_data = add_vote(guild, channel, voters=voters)
+    run = Run(rest)
+    for _ in range(iterations):
+        interaction = FakeInteraction(staff, channel)
+        await run.timed(app.vote_status.callback(interaction, vote_data["short_id"]))
+    return run, iterations
+
+
+async def scenario_ticket_verify(scale):
+    """管理员在工单中发送审核关键词（开票人未缓存，需要读取频道历史）"""
+    tickets = int(200 * scale)
+    rest = RestCounter()
+    guild, staff, _ = build_ticket_guild(members=tickets, pending=tickets, tickets=tickets, rest=rest)
+    tickets_channels = guild.text_channels
+    attach_log_channel(guild)
+    run = Run(rest)
+    for channel in tickets_channels:
+        message = FakeMessage(channel, staff, "审核通过")
+        await run.timed(app.on_message(message))
+    return run, tickets
+
+
+async def scenario_save_votes(scale):
+    """20k 投票者的投票全量写入 file 存储"""
+    voters = int(20000 * scale)
+    iterations = 20
+    rest = RestCounter()
+    guild, _, _ = build_ticket_guild(members=voters, rest=rest)
+    channel = guild.add_text_channel("投票")
+    add_vote(guild, channel, voters=voters)
+    run = Run(rest)
+    for _ in range(iterations):
+        await run.timed(app.save_votes_data())
+    return run, iterations
+
+
+SCENARIOS = {
+    "vote_clicks": scenario_vote_clicks,
+    "startup_scan": scenario_startup_scan,
+    "vote_status": scenario_vote_status,
+    "ticket_verify": scenario_ticket_verify,
+    "save_votes": scenario_save_votes,
+}
+
+
+async def run_scenario(name, scale):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        reset_app_state(tmpdir)
+        tracemalloc.start()
+        start = time.perf_counter()
+        run, ops = await SCENARIOS[name](scale)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "ops": ops,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(ops / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(run.samples, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(run.samples, 0.99) * 1000, 3),
+        "max_ms": round(max(run.samples, default=0) * 1000, 3),
+        "rest_calls": run.rest.total(),
+        "rest_by_route": dict(sorted(run.rest.calls.items())),
+        "peak_memory_kb": round(peak / 1024),
+    }
+
+
+# 对比时越小越好 / 越大越好的指标
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "rest_calls", "peak_memory_kb")
+HIGHER_IS_BETTER = ("throughput_per_s",)
+
+
+def compare(baseline, current, threshold):
+    """打印与基准结果的差异，返回是否有超过 threshold 的退化"""
+    regressed = False
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            print(f"{name}: 基准中没有此场景")
+            continue
+        parts = []
+        for key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            old, new = base.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if key in LOWER_IS_BETTER else change < -threshold
+            regressed |= worse
+            parts.append(f"{key} {old} -> {new} ({change:+.0%}){' ⚠️' if worse else ''}")
+        print(f"{name}: " + "，".join(parts))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="机器人处理函数离线基准测试")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="要运行的场景，可重复指定，默认全部")
+    parser.add_argument("--scale", type=float, default=1.0, help="按比例缩放场景规模")
+    parser.add_argument("-o", "--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="对比时视为退化的变化比例")
+    args = parser.parse_args()
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "scale": args.scale,
+        "scenarios": {},
+    }
+    for name in args.scenario or SCENARIOS:
+        results["scenarios"][name] = asyncio.run(run_scenario(name, args.scale))
+        r = results["scenarios"][name]
+        print(f"{name}: {r['ops']} 次，{r['throughput_per_s']}/s，p50 {r['p50_ms']}ms，p99 {r['p99_ms']}ms，"
+              f"REST {r['rest_calls']}，峰值内存 {r['peak_memory_kb']}KB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""比较各存储方式的保存/加载耗时和传输字节数
+
+    python -m tools.bench_storage
+    python -m tools.bench_storage --voters 100 1000 10000 --latency 0.05 -o storage.json
+
+file 和 journal 写入临时目录；cloudflare_kv 和 github 连接到本进程内启动的替身服务器
+（tools.stub_servers），可以注入延迟、429 和 SHA 冲突。
+对每个规模分别测量：全量保存、只修改一个投票后的增量保存、冷启动加载。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from tools.stub_servers import make_stub_app, start_app  # noqa: E402
+
+BACKENDS = ("file", "journal", "cloudflare_kv", "github")
+
+
+def build_votes(total_voters, vote_count):
+    """生成 vote_count 个投票，共 total_voters 个投票者"""
+    votes = {}
+    now = time.time()
+    per_vote = total_voters // vote_count
+    for v in range(vote_count):
+        options = ["赞成", "反对", "弃权"]
+        vote = {
+            "title": f"存储基准投票 {v}",
+            "options": options,
+            "votes": [0] * len(options),
+            "voters": app.VoterStore(),
+            "allowed_role": "@everyone",
+            "creator": "bench",
+            "channel_id": 1000 + v,
+            "guild_id": 1,
+            "end_time": (datetime.now() + timedelta(hours=24)).isoformat(),
+            "short_id": str(v + 1),
+        }
+        for i in range(per_vote):
+            option = i % len(options)
+            vote["votes"][option] += 1
+            vote["voters"].add(10 ** 17 + v * per_vote + i, option, f"user{i}#{i % 10000:04d}", now)
+        votes[f"1_{1000 + v}_{v}"] = vote
+    return votes
+
+
+def configure(backend, tmpdir, base_url):
+    """把机器人的存储配置指向临时目录或替身服务器"""
+    app.STORAGE_TYPE = backend
+    app.VOTES_DATA_FILE = os.path.join(tmpdir, "votes_data.json")
+    app.vote_journal = app.VoteJournal(app.VOTES_DATA_FILE, os.path.join(tmpdir, "votes_journal.jsonl"))
+    app.CLOUDFLARE_API_BASE = f"{base_url}/client/v4"
+    app.CLOUDFLARE_ACCOUNT_ID = app.CLOUDFLARE_NAMESPACE_ID = app.CLOUDFLARE_API_TOKEN = "bench"
+    app.GITHUB_API_BASE = base_url
+    app.GITHUB_REPO = "bench/votes"
+    app.GITHUB_TOKEN = "bench"
+    app._kv_index_ids = None
+    app._github_shas.clear()
+    app._github_branches.clear()
+
+
+def local_bytes(tmpdir):
+    return sum(os.path.getsize(os.path.join(tmpdir, name)) for name in os.listdir(tmpdir))
+
+
+class Meter:
+    """一次操作的耗时和传输字节数（远程为替身服务器统计，本地为目录大小变化）"""
+
+    def __init__(self, stub, tmpdir, backend):
+        self.stub = stub
+        self.tmpdir = tmpdir
+        self.remote = backend in ("cloudflare_kv", "github")
+
+    def _snapshot(self):
+        if self.remote:
+            stats = self.stub["stats"].summary()
+            return stats["bytes_in"], stats["bytes_out"], sum(stats["requests"].values())
+        return local_bytes(self.tmpdir), 0, 0
+
+    async def measure(self, coro):
+        before = self._snapshot()
+        start = time.perf_counter()
+        result = await coro
+        elapsed = time.perf_counter() - start
+        after = self._snapshot()
+        report = {"ms": round(elapsed * 1000, 1), "ok": result is not False}
+        if self.remote:
+            report["bytes_sent"] = after[0] - before[0]
+            report["bytes_received"] = after[1] - before[1]
+            report["requests"] = after[2] - before[2]
+        else:
+            report["bytes_on_disk"] = after[0]
+        return report
+
+
+async def bench_backend(backend, votes, stub, base_url):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configure(backend, tmpdir, base_url)
+        meter = Meter(stub, tmpdir, backend)
+        app.active_votes = votes
+        result = {"full_save": await meter.measure(app.save_votes_data())}
+
+        # 一次投票后的增量保存（journal 只追加一条记录，与写回任务的路径一致）
+        vote_id = next(iter(votes))
+        user_id = 10 ** 18
+        votes[vote_id]["votes"][0] += 1
+        votes[vote_id]["voters"].add(user_id, 0, "bench#0001", time.time())
+        record = {"op": "vote", "id": vote_id, "uid": str(user_id), "o": 0, "u": "bench#0001",
+                  "t": datetime.now().isoformat()}
+        result["incremental_save"] = await meter.measure(app._write_votes({vote_id}, 1, [record]))
+
+        # 冷启动加载：清掉缓存的状态
+        app._kv_index_ids = None
+        app._github_shas.clear()
+        load = {}
+
+        async def timed_load():
+            load["votes"] = await app.load_votes_data()
+
+        result["load"] = await meter.measure(timed_load())
+        loaded_voters = sum(len(v["voters"]) for v in load["votes"].values())
+        result["load"]["ok"] = loaded_voters == sum(len(v["voters"]) for v in votes.values())
+        return result
+
+
+async def run(args):
+    stub = make_stub_app(latency=args.latency, rate_limit_every=args.rate_limit_every,
+                         conflict_every=args.conflict_every)
+    runner, base_url = await start_app(stub)
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "latency": args.latency,
+        "rate_limit_every": args.rate_limit_every,
+        "conflict_every": args.conflict_every,
+        "runs": [],
+    }
+    try:
+        for voters in args.voters:
+            votes_template = build_votes(voters, args.votes)
+            for backend in args.backend or BACKENDS:
+                # 每个存储方式使用同样的初始数据
+                votes = app.use_compact_voters(json.loads(json.dumps(votes_template, default=app._json_default)))
+                report = await bench_backend(backend, votes, stub, base_url)
+                results["runs"].append({"backend": backend, "voters": voters, **report})
+                parts = [f"{op} {r['ms']}ms" + ("" if r["ok"] else " 失败") for op, r in report.items()]
+                sent = report["full_save"].get("bytes_sent", report["full_save"].get("bytes_on_disk"))
+                print(f"{backend:>13} {voters:>7} 人: " + "，".join(parts) + f"，全量写入 {sent} 字节")
+    finally:
+        await app.close_http_session()
+        await runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="存储方式基准测试")
+    parser.add_argument("--voters", type=int, nargs="+", default=[100, 1000, 10000], help="投票者总数（可多个）")
+    parser.add_argument("--votes", type=int, default=5, help="投票者分布在多少个投票中")
+    parser.add_argument("-b", "--backend", action="append", choices=BACKENDS, help="只测试指定存储方式，可重复")
+    parser.add_argument("--latency", type=float, default=0.0, help="替身服务器每个请求的延迟（秒）")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="替身服务器每第 N 个请求返回 429")
+    parser.add_argument("--conflict-every", type=int, default=0, help="每第 N 次 GitHub 提交返回 SHA 冲突")
+    parser.add_argument("-o", "--output", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
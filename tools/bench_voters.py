@@ -0,0 +1,79 @@
+"""比较投票者的两种内存表示
+
+    python -m tools.bench_voters --voters 10000
+
+分别用原来的字典格式和 VoterStore 保存同样数量的投票者，
+报告 tracemalloc 测得的内存占用和序列化后的 JSON 大小。
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import VoterStore, _json_default  # noqa: E402
+
+
+def sample_voters(count, options=4):
+    """生成 (用户ID, 选项, 名称, 时间) 样本"""
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        yield (
+            100000000000000000 + i * 7919,
+            i % options,
+            f"user{i % 5000}#{i % 10000:04d}",
+            start + timedelta(seconds=i)
+        )
+
+
+def build_dicts(samples):
+    voters = {}
+    for user_id, option_index, name, when in samples:
+        voters[str(user_id)] = {"option": option_index, "user": name, "time": when.isoformat()}
+    return voters
+
+
+def build_store(samples):
+    store = VoterStore()
+    for user_id, option_index, name, when in samples:
+        store.add(user_id, option_index, name, when.timestamp())
+    return store
+
+
+def measure(builder, samples):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    voters = builder(samples)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return voters, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投票者内存表示对比")
+    parser.add_argument("--voters", type=int, default=10000)
+    args = parser.parse_args()
+
+    # 样本（包括名称字符串）事先生成，两种表示只计自身的开销
+    samples = list(sample_voters(args.voters))
+    dicts, dict_bytes = measure(build_dicts, samples)
+    store, store_bytes = measure(build_store, samples)
+
+    dict_json = json.dumps(dicts, ensure_ascii=False, indent=2)
+    store_json = json.dumps(store, ensure_ascii=False, indent=2, default=_json_default)
+    print(json.dumps({
+        "voters": args.voters,
+        "dict_bytes": dict_bytes,
+        "store_bytes": store_bytes,
+        "ratio": round(dict_bytes / store_bytes, 2) if store_bytes else None,
+        "dict_json_bytes": len(dict_json.encode()),
+        "store_json_bytes": len(store_json.encode()),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
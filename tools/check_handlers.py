@@ -0,0 +1,114 @@
+"""用替身 Discord 对象检查处理函数在失败路径上的行为
+
+    python -m tools.check_handlers            # 运行全部检查，有失败时退出码为 1
+    python -m tools.check_handlers -c verify_role_edit_fails
+
+与 tools.bench_handlers 共用替身对象和状态重置，只断言结果，不计时。
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+
+import app  # noqa: E402
+from tools.bench_handlers import attach_log_channel, reset_app_state  # noqa: E402
+from tools.fakes import FakeMessage, RestCounter, build_ticket_guild  # noqa: E402
+
+
+class FakeHTTPResponse:
+    """构造 discord.HTTPException 所需的最小响应对象"""
+
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+def setup_ticket():
+    """一个待审核成员、一个工单频道，归档分类指向替身分类"""
+    rest = RestCounter()
+    guild, staff, roles = build_ticket_guild(members=1, pending=1, tickets=1, posted_ratio=1.0, rest=rest)
+    channel = guild.text_channels[0]
+    owner = channel.messages[0].mentions[0]
+    attach_log_channel(guild)
+    # 处理函数用 isinstance 判断归档分类，替身需要是真正的 CategoryChannel 实例
+    category = object.__new__(discord.CategoryChannel)
+    app.guild_index._channels[app.ARCHIVE_CATEGORY_ID] = category
+    return guild, staff, roles, channel, owner, category
+
+
+def check(condition, description):
+    if not condition:
+        raise AssertionError(description)
+
+
+# --- 检查项 ---
+
+async def check_verify_success():
+    """审核通过：一次身份组替换，频道归档，发送一条确认消息"""
+    guild, staff, roles, channel, owner, category = setup_ticket()
+    await app.on_message(FakeMessage(channel, staff, "审核通过"))
+    check(owner.get_role(roles[app.VERIFIED_ROLE_NAME].id) is not None, "开票人应获得已审核身份组")
+    check(owner.get_role(roles[app.PENDING_ROLE_NAME].id) is None, "开票人的待审核身份组应被移除")
+    check(guild.rest.calls.get("member.edit") == 1, f"应只有一次 member.edit: {guild.rest.calls}")
+    check(channel.name.startswith("closed-") and channel.category is category, "频道应被重命名并移入归档分类")
+    confirmations = [m for m in channel.messages if "已审核通过" in m.content]
+    check(len(confirmations) == 1, f"应发送一条确认消息，实际 {len(confirmations)} 条")
+
+
+async def check_verify_role_edit_fails():
+    """身份组替换失败：不归档、不确认，开票人仍保留待审核身份组"""
+    guild, staff, roles, channel, owner, category = setup_ticket()
+
+    async def failing_edit(**kwargs):
+        await guild.rest.call("member.edit")
+        raise discord.Forbidden(FakeHTTPResponse(403, "Forbidden"), "Missing Permissions")
+
+    owner.edit = failing_edit
+    await app.on_message(FakeMessage(channel, staff, "审核通过"))
+    check(owner.get_role(roles[app.PENDING_ROLE_NAME].id) is not None, "失败时待审核身份组应保留")
+    check(channel.name.startswith(app.TICKET_CHANNEL_PREFIX) and channel.category is None, "失败时频道不应被归档")
+    check("channel.edit" not in guild.rest.calls, f"失败时不应修改频道: {guild.rest.calls}")
+    check(not any("已审核通过" in m.content for m in channel.messages), "失败时不应发送确认消息")
+    check(any("身份组失败" in m.content for m in channel.messages), "失败时应在工单中提示管理员")
+    # 工单仍在索引中，到期检查不会把该成员当作没有工单
+    check(await app._member_has_ticket(guild, owner), "失败后成员仍应被视为有工单")
+
+
+CHECKS = {
+    "verify_success": check_verify_success,
+    "verify_role_edit_fails": check_verify_role_edit_fails,
+}
+
+
+async def run_check(name):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        reset_app_state(tmpdir)
+        await app.ticket_activity.rebuild([])
+        await CHECKS[name]()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="处理函数失败路径检查")
+    parser.add_argument("-c", "--check", action="append", choices=sorted(CHECKS),
+                        help="要运行的检查，可重复指定，默认全部")
+    args = parser.parse_args()
+
+    failed = 0
+    for name in args.check or CHECKS:
+        try:
+            asyncio.run(run_check(name))
+            print(f"✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {name}: {e}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""离线测试用的 Discord 对象替身
+
+只实现机器人处理函数实际用到的属性和方法。所有“REST 调用”都记录在 RestCounter 中，
+可以设置固定延迟模拟网络往返，用于统计一次操作会产生多少 API 请求。
+"""
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id():
+    return next(_ids)
+
+
+class RestCounter:
+    """按路由统计模拟的 REST 调用次数"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+
+    async def call(self, route):
+        self.calls[route] = self.calls.get(route, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls = {}
+
+
+class FakeRole:
+    def __init__(self, name, role_id=None):
+        self.id = role_id or next_id()
+        self.name = name
+
+    @property
+    def mention(self):
+        return f"<@&{self.id}>"
+
+    def is_default(self):
+        return self.name == "@everyone"
+
+
+class FakeUser:
+    def __init__(self, name, user_id=None, bot=False):
+        self.id = user_id or next_id()
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember(FakeUser):
+    def __init__(self, guild, name, roles=(), user_id=None, bot=False, joined_at=None):
+        super().__init__(name, user_id, bot)
+        self.guild = guild
+        self._roles = {role.id: role for role in roles}
+        self.joined_at = joined_at or datetime.now(timezone.utc)
+
+    @property
+    def roles(self):
+        return list(self._roles.values())
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    async def add_roles(self, *roles, reason=None):
+        await self.guild.rest.call("member.add_roles")
+        for role in roles:
+            self._roles[role.id] = role
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.guild.rest.call("member.remove_roles")
+        for role in roles:
+            self._roles.pop(role.id, None)
+
+    async def edit(self, *, roles=None, reason=None, **kwargs):
+        await self.guild.rest.call("member.edit")
+        if roles is not None:
+            self._roles = {role.id: role for role in roles}
+
+    async def kick(self, reason=None):
+        await self.guild.rest.call("member.kick")
+        self.guild.remove_member(self)
+
+    async def send(self, content=None, **kwargs):
+        await self.guild.rest.call("dm.send")
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content="", mentions=(), message_id=None):
+        self.id = message_id or next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.created_at = datetime.now(timezone.utc)
+
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        await self.channel.guild.rest.call("message.edit")
+
+
+class FakeTextChannel:
+    HISTORY_PAGE = 100
+
+    def __init__(self, guild, name, channel_id=None, category=None):
+        self.id = channel_id or next_id()
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.messages = []
+        self.deleted = False
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    def add_message(self, author, content="", mentions=()):
+        """直接放入历史消息（不计 REST 调用），用于搭建场景"""
+        message = FakeMessage(self, author, content, mentions)
+        self.messages.append(message)
+        return message
+
+    async def send(self, content=None, view=None, **kwargs):
+        await self.guild.rest.call("channel.send")
+        return self.add_message(self.guild.me, content or "")
+
+    async def edit(self, *, name=None, category=None, **kwargs):
+        await self.guild.rest.call("channel.edit")
+        if name is not None:
+            self.name = name
+        if category is not None:
+            self.category = category
+
+    async def delete(self, reason=None):
+        await self.guild.rest.call("channel.delete")
+        self.deleted = True
+        self.guild.remove_channel(self)
+
+    async def history(self, limit=100, oldest_first=False):
+        messages = self.messages if oldest_first else list(reversed(self.messages))
+        if limit is not None:
+            messages = messages[:limit]
+        for i, message in enumerate(messages):
+            if i % self.HISTORY_PAGE == 0:
+                await self.guild.rest.call("channel.history")
+            yield message
+        if not messages:
+            await self.guild.rest.call("channel.history")
+
+    def get_partial_message(self, message_id):
+        return FakePartialMessage(self, message_id)
+
+
+class FakeGuild:
+    def __init__(self, name="bench", rest=None, role_names=("@everyone",)):
+        self.id = next_id()
+        self.name = name
+        self.rest = rest or RestCounter()
+        self.roles = [FakeRole(n) for n in role_names]
+        self._members = {}
+        self._channels = {}
+        self.me = FakeMember(self, "bot#0000", bot=True)
+
+    def add_role(self, name):
+        role = FakeRole(name)
+        self.roles.append(role)
+        return role
+
+    def get_role(self, role_id):
+        for role in self.roles:
+            if role.id == role_id:
+                return role
+        return None
+
+    def add_member(self, name, roles=(), joined_at=None):
+        member = FakeMember(self, name, roles, joined_at=joined_at)
+        self._members[member.id] = member
+        return member
+
+    def remove_member(self, member):
+        self._members.pop(member.id, None)
+
+    def add_text_channel(self, name, channel_id=None):
+        channel = FakeTextChannel(self, name, channel_id)
+        self._channels[channel.id] = channel
+        return channel
+
+    def remove_channel(self, channel):
+        self._channels.pop(channel.id, None)
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def member_count(self):
+        return len(self._members)
+
+    @property
+    def text_channels(self):
+        return list(self._channels.values())
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    async def fetch_member(self, member_id):
+        await self.rest.call("guild.fetch_member")
+        member = self._members.get(member_id)
+        if member is None:
+            raise LookupError(member_id)
+        return member
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+        self.messages = []
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, *, view=None, ephemeral=False, **kwargs):
+        if self._done:
+            raise RuntimeError("interaction has already been responded to")
+        await self._interaction.guild.rest.call("interaction.response")
+        self._done = True
+        self.messages.append(content)
+
+    async def defer(self, ephemeral=False, thinking=False):
+        await self._interaction.guild.rest.call("interaction.response")
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self._interaction.guild.rest.call("interaction.followup")
+        self._interaction.response.messages.append(content)
+
+
+class FakeInteraction:
+    def __init__(self, user, channel):
+        self.id = next_id()
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.guild_id = channel.guild.id
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def original_response(self):
+        await self.guild.rest.call("interaction.original_response")
+        return FakePartialMessage(self.channel, next_id())
+
+
+def build_ticket_guild(members=0, pending=0, tickets=0, posted_ratio=0.5, rest=None,
+                       staff_role="管理", verified_role="已审核", pending_role="待审核",
+                       ticket_prefix="ticket-", join_age=timedelta(hours=1)):
+    """搭建一个带待审核成员和工单频道的服务器
+
+    前 pending 个成员带待审核身份组，其中前 tickets 个各有一个工单频道，
+    约 posted_ratio 比例的开票人在工单中发过言。
+    """
+    guild = FakeGuild(rest=rest, role_names=("@everyone", staff_role, verified_role, pending_role))
+    roles = {role.name: role for role in guild.roles}
+    staff = guild.add_member("staff#0001", [roles[staff_role]])
+    joined_at = datetime.now(timezone.utc) - join_age
+    for i in range(max(members, pending)):
+        member_roles = [roles[pending_role]] if i < pending else [roles[verified_role]]
+        guild.add_member(f"member{i}#{i % 10000:04d}", member_roles, joined_at=joined_at)
+    owners = [m for m in guild.members if m.get_role(roles[pending_role].id)][:tickets]
+    for i, owner in enumerate(owners):
+        channel = guild.add_text_channel(f"{ticket_prefix}{i:04d}")
+        channel.add_message(guild.me, f"{owner.mention} 欢迎", mentions=[owner])
+        channel.add_message(guild.me, "请填写审核问卷")
+        if i < tickets * posted_ratio:
+            channel.add_message(owner, "你好，我来审核")
+    return guild, staff, roles
@@ -0,0 +1,230 @@
+"""按录制的真实流量回放事件，测量处理函数的延迟和 REST 调用
+
+先在机器人上设置 EVENT_RECORD_FILE=events.jsonl 录制一段时间，然后：
+
+    python -m tools.replay events.jsonl                 # 按原速回放
+    python -m tools.replay events.jsonl --speed 10      # 10 倍速
+    python -m tools.replay events.jsonl --speed 0       # 不等待，尽快回放
+    python -m tools.replay events.jsonl --rest-latency 0.05 -o replay.json
+
+事件在替身 Discord 对象（tools.fakes）上重建：服务器、频道、成员按匿名ID首次出现时创建，
+消息先写入频道历史再交给 on_message，和真实网关的顺序一致。每个事件在独立任务中处理，
+与 discord.py 的事件分发方式相同。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from tools.bench_handlers import attach_log_channel, percentile, reset_app_state  # noqa: E402
+from tools.fakes import FakeGuild, FakeInteraction, FakeMember, FakeMessage, RestCounter  # noqa: E402
+
+MAX_VOTE_OPTIONS = 10
+
+
+class ReplayWorld:
+    """按匿名ID懒创建的替身服务器、频道和成员"""
+
+    def __init__(self, rest):
+        self.rest = rest
+        self.guilds = {}
+        self.channels = {}
+        self.members = {}
+        self.votes = {}
+        self.roles = {}
+
+    def guild(self, gid):
+        guild = self.guilds.get(gid)
+        if guild is None:
+            guild = FakeGuild(name=f"guild-{gid}", rest=self.rest, role_names=(
+                "@everyone", app.STAFF_ROLE_NAME, app.VERIFIED_ROLE_NAME, app.PENDING_ROLE_NAME))
+            self.guilds[gid] = guild
+            self.roles[gid] = {role.name: role for role in guild.roles}
+            if len(self.guilds) == 1:
+                # 日志频道放在第一个服务器里
+                attach_log_channel(guild)
+        return guild
+
+    def channel(self, gid, cid, name="channel"):
+        channel = self.channels.get(cid)
+        if channel is None:
+            channel = self.guild(gid).add_text_channel(name)
+            self.channels[cid] = channel
+        elif channel.deleted:
+            # 频道被回放中的操作删除后又收到消息：重新放回服务器
+            channel.deleted = False
+            channel.guild._channels[channel.id] = channel
+        return channel
+
+    def member(self, gid, uid, role_names=(), bot=False):
+        guild = self.guild(gid)
+        member = self.members.get((gid, uid))
+        if member is None:
+            member = FakeMember(guild, f"user{uid % 100000}", bot=bot,
+                                joined_at=datetime.now().astimezone() - timedelta(hours=1))
+            self.members[(gid, uid)] = member
+        if guild.get_member(member.id) is None:
+            guild._members[member.id] = member
+        # 以录制时的身份组为准
+        roles = self.roles[gid]
+        member._roles = {roles[name].id: roles[name] for name in role_names if name in roles}
+        return member
+
+    def vote(self, gid, cid, vid):
+        """首次点击时创建对应的投票（选项数取上限，保证任意选项序号有效）"""
+        vote_id = self.votes.get(vid)
+        if vote_id is None:
+            channel = self.channel(gid, cid)
+            vote_id = f"{channel.guild.id}_{channel.id}_{vid}"
+            vote_data = {
+                "title": f"回放投票 {vid}",
+                "options": [f"选项{i + 1}" for i in range(MAX_VOTE_OPTIONS)],
+                "votes": [0] * MAX_VOTE_OPTIONS,
+                "voters": app.VoterStore(),
+                "allowed_role": "@everyone",
+                "creator": "replay",
+                "channel_id": channel.id,
+                "guild_id": channel.guild.id,
+                "end_time": (datetime.now() + timedelta(hours=24)).isoformat(),
+                "live_results": False,
+            }
+            app.active_votes[vote_id] = vote_data
+            app.vote_registry.register(vote_id, vote_data)
+            self.votes[vid] = vote_id
+        return vote_id
+
+
+def message_content(record):
+    if record["k"] == "verify":
+        return "审核通过"
+    if record["k"] == "kick":
+        return app.KICK_KEYWORD
+    return "x" * record.get("n", 0)
+
+
+def build_dispatch(world, record):
+    """返回 (处理函数名, 协程)，不支持的事件返回 None"""
+    event = record["e"]
+    if event == "msg":
+        author = world.member(record["g"], record["a"], record.get("r", ()), bot=record.get("b", False))
+        channel = world.channel(record["g"], record["c"], record.get("cn", "channel"))
+        mentions = [world.member(record["g"], uid) for uid in record.get("m", ())]
+        message = FakeMessage(channel, author, message_content(record), mentions)
+        channel.messages.append(message)
+        name = "on_message" if record["k"] == "other" else f"on_message.{record['k']}"
+        return name, app.on_message(message)
+    if event == "join":
+        member = world.member(record["g"], record["u"], record.get("r", ()))
+        return "on_member_join", app.on_member_join(member)
+    if event == "click" and "v" in record:
+        user = world.member(record["g"], record["u"], record.get("r", ()))
+        channel = world.channel(record["g"], record["c"])
+        vote_id = world.vote(record["g"], record["c"], record["v"])
+        return "vote_click", app.handle_vote_click(FakeInteraction(user, channel), vote_id, record["o"])
+    return None
+
+
+async def replay(records, speed, rest_latency):
+    rest = RestCounter(rest_latency)
+    world = ReplayWorld(rest)
+    samples = {}
+    errors = {}
+    skipped = 0
+
+    async def run_one(name, coro):
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            errors[name] = errors.get(name, 0) + 1
+            print(f"回放 {name} 出错: {e}")
+        samples.setdefault(name, []).append(time.perf_counter() - start)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    tasks = []
+    for record in records:
+        if speed > 0:
+            delay = started + record.get("t", 0) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        dispatch = build_dispatch(world, record)
+        if dispatch is None:
+            skipped += 1
+            continue
+        tasks.append(asyncio.create_task(run_one(*dispatch)))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - started
+
+    handlers = {}
+    for name, values in sorted(samples.items()):
+        handlers[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(max(values) * 1000, 3),
+        }
+    return {
+        "events": len(records),
+        "skipped": skipped,
+        "seconds": round(elapsed, 3),
+        "recorded_seconds": records[-1].get("t", 0) if records else 0,
+        "events_per_s": round((len(records) - skipped) / elapsed, 1) if elapsed else None,
+        "handlers": handlers,
+        "rest_calls": rest.total(),
+        "rest_by_route": dict(sorted(rest.calls.items())),
+        "member_checks_scheduled": len(app.member_check_scheduler),
+    }
+
+
+def load_records(path):
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 录制中断时最后一行可能不完整
+                print(f"跳过无法解析的记录: {line[:80]}")
+    records.sort(key=lambda r: r.get("t", 0))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的网关事件")
+    parser.add_argument("log", help="EVENT_RECORD_FILE 录制的 JSONL 文件")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示不等待")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="每次模拟 REST 调用的延迟（秒）")
+    parser.add_argument("-o", "--output", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    records = load_records(args.log)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        reset_app_state(tmpdir)
+        result = asyncio.run(replay(records, args.speed, args.rest_latency))
+    result["log"] = args.log
+    result["speed"] = args.speed
+
+    print(f"回放 {result['events']} 个事件（跳过 {result['skipped']}），耗时 {result['seconds']}s，"
+          f"REST 调用 {result['rest_calls']} 次")
+    for name, h in result["handlers"].items():
+        print(f"  {name}: {h['count']} 次，p50 {h['p50_ms']}ms，p99 {h['p99_ms']}ms，最大 {h['max_ms']}ms，错误 {h['errors']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
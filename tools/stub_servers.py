@@ -0,0 +1,293 @@
+"""远程存储的本地替身服务器
+
+用于在没有真实凭据和网络的情况下测试 cloudflare_kv 和 github 存储：
+
+    python -m tools.stub_servers --port 8787
+
+然后设置环境变量让机器人连接到本地：
+
+    CLOUDFLARE_API_BASE=http://127.0.0.1:8787/client/v4
+    CLOUDFLARE_ACCOUNT_ID=test CLOUDFLARE_NAMESPACE_ID=test CLOUDFLARE_API_TOKEN=test
+
+    GITHUB_API_BASE=http://127.0.0.1:8787
+    GITHUB_REPO=test/votes GITHUB_TOKEN=test
+
+--latency、--rate-limit-every、--conflict-every 可以注入网络延迟、429 和 SHA 冲突。
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+
+from aiohttp import web
+
+
+class RequestStats:
+    """记录请求次数和传输字节数"""
+
+    def __init__(self):
+        self.requests = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, method, bytes_in=0, bytes_out=0):
+        self.requests[method] = self.requests.get(method, 0) + 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def summary(self):
+        return {
+            "requests": dict(self.requests),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+def make_fault_middleware(latency=0.0, rate_limit_every=0):
+    """每个请求前等待 latency 秒；rate_limit_every 为 N 时每第 N 个请求返回 429"""
+    counter = {"requests": 0}
+
+    @web.middleware
+    async def faults(request, handler):
+        counter["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if rate_limit_every and counter["requests"] % rate_limit_every == 0:
+            request.app["stats"].record("429")
+            return web.json_response(
+                {"message": "API rate limit exceeded (stub)"},
+                status=429, headers={"Retry-After": "1"}
+            )
+        return await handler(request)
+
+    return faults
+
+
+def _new_app(latency=0.0, rate_limit_every=0):
+    app = web.Application(middlewares=[make_fault_middleware(latency, rate_limit_every)])
+    app["stats"] = RequestStats()
+    return app
+
+
+# --- Cloudflare KV values 接口 ---
+KV_VALUES_PATH = "/client/v4/accounts/{account}/storage/kv/namespaces/{namespace}/values/{key}"
+
+
+def make_kv_app(token=None, latency=0.0, rate_limit_every=0):
+    """创建 KV 替身应用，数据保存在 app["kv_store"]，按命名空间区分"""
+    app = _new_app(latency, rate_limit_every)
+    add_kv_routes(app, token)
+    return app
+
+
+def add_kv_routes(app, token=None):
+    app["kv_store"] = {}
+
+    def check_auth(request):
+        if token is not None and request.headers.get("Authorization") != f"Bearer {token}":
+            raise web.HTTPForbidden(text='{"success":false,"errors":[{"code":10000,"message":"Authentication error"}]}')
+
+    def namespace(request):
+        return app["kv_store"].setdefault(request.match_info["namespace"], {})
+
+    async def get_value(request):
+        check_auth(request)
+        value = namespace(request).get(request.match_info["key"])
+        if value is None:
+            app["stats"].record("GET")
+            return web.json_response(
+                {"success": False, "errors": [{"code": 10009, "message": "get: 'key not found'"}]},
+                status=404
+            )
+        app["stats"].record("GET", bytes_out=len(value))
+        return web.Response(body=value, content_type="application/octet-stream")
+
+    async def put_value(request):
+        check_auth(request)
+        body = await request.read()
+        namespace(request)[request.match_info["key"]] = body
+        app["stats"].record("PUT", bytes_in=len(body))
+        return web.json_response({"success": True, "errors": [], "messages": [], "result": None})
+
+    async def delete_value(request):
+        check_auth(request)
+        namespace(request).pop(request.match_info["key"], None)
+        app["stats"].record("DELETE")
+        return web.json_response({"success": True, "errors": [], "messages": [], "result": None})
+
+    app.router.add_get(KV_VALUES_PATH, get_value)
+    app.router.add_put(KV_VALUES_PATH, put_value)
+    app.router.add_delete(KV_VALUES_PATH, delete_value)
+
+
+# --- GitHub contents 接口 ---
+GITHUB_CONTENTS_PATH = "/repos/{owner}/{repo}/contents/{path:.+}"
+
+
+def _git_blob_sha(content):
+    """与 git 相同的 blob SHA"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def make_github_app(token=None, latency=0.0, rate_limit_every=0, conflict_every=0):
+    """创建 GitHub contents 替身应用，文件保存在 app["github_files"][(仓库, 分支, 路径)]"""
+    app = _new_app(latency, rate_limit_every)
+    add_github_routes(app, token, conflict_every)
+    return app
+
+
+def add_github_routes(app, token=None, conflict_every=0, default_branch="main"):
+    """conflict_every 为 N 时，每第 N 次提交前模拟一次他人提交（文件 SHA 改变），使本次提交返回 409
+
+    文件按 (仓库, 分支, 路径) 存储；读取用 ?ref=，提交用 "branch" 字段，未指定时为 default_branch。
+    """
+    app["github_files"] = {}
+    app["github_branches"] = {default_branch}
+    puts = {"count": 0}
+
+    def check_auth(request):
+        if token is not None and request.headers.get("Authorization") != f"token {token}":
+            raise web.HTTPUnauthorized(text='{"message":"Bad credentials"}', content_type="application/json")
+
+    def file_key(request, branch=None):
+        repo = f"{request.match_info['owner']}/{request.match_info['repo']}"
+        return repo, branch or default_branch, request.match_info["path"]
+
+    def store(key, content):
+        sha = _git_blob_sha(content)
+        app["github_files"][key] = {"content": content, "sha": sha}
+        return sha
+
+    async def get_contents(request):
+        check_auth(request)
+        branch = request.query.get("ref")
+        if branch and branch not in app["github_branches"]:
+            app["stats"].record("GET")
+            return web.json_response({"message": f"No commit found for the ref {branch}"}, status=404)
+        entry = app["github_files"].get(file_key(request, branch))
+        if entry is None:
+            app["stats"].record("GET")
+            return web.json_response({"message": "Not Found"}, status=404)
+        # 与 GitHub 一样每 60 个字符换行
+        encoded = base64.b64encode(entry["content"]).decode()
+        encoded = "\n".join(encoded[i:i + 60] for i in range(0, len(encoded), 60))
+        body = {
+            "type": "file",
+            "encoding": "base64",
+            "path": request.match_info["path"],
+            "size": len(entry["content"]),
+            "sha": entry["sha"],
+            "content": encoded,
+        }
+        response = web.json_response(body)
+        app["stats"].record("GET", bytes_out=len(response.body))
+        return response
+
+    async def put_contents(request):
+        check_auth(request)
+        raw = await request.read()
+        app["stats"].record("PUT", bytes_in=len(raw))
+        payload = json.loads(raw)
+        if payload.get("branch", default_branch) not in app["github_branches"]:
+            return web.json_response({"message": "Branch not found"}, status=404)
+        key = file_key(request, payload.get("branch"))
+        puts["count"] += 1
+        if conflict_every and puts["count"] % conflict_every == 0 and key in app["github_files"]:
+            # 模拟其他人先提交了一次
+            store(key, app["github_files"][key]["content"] + b"\n")
+        entry = app["github_files"].get(key)
+        sha = payload.get("sha")
+        if entry is not None and sha != entry["sha"]:
+            status = 422 if sha is None else 409
+            message = "\"sha\" wasn't supplied." if sha is None else f"{key[2]} does not match {sha}"
+            return web.json_response({"message": message}, status=status)
+        if entry is None and sha is not None:
+            return web.json_response({"message": "sha does not match any file"}, status=422)
+        new_sha = store(key, base64.b64decode(payload["content"]))
+        return web.json_response(
+            {"content": {"path": key[2], "sha": new_sha}, "commit": {"message": payload.get("message")}},
+            status=200 if entry is not None else 201
+        )
+
+    async def get_repo(request):
+        check_auth(request)
+        app["stats"].record("GET")
+        return web.json_response({"full_name": f"{request.match_info['owner']}/{request.match_info['repo']}",
+                                  "default_branch": default_branch})
+
+    async def get_ref(request):
+        check_auth(request)
+        app["stats"].record("GET")
+        branch = request.match_info["branch"]
+        if branch not in app["github_branches"]:
+            return web.json_response({"message": "Not Found"}, status=404)
+        # 替身不维护提交历史，用分支名生成固定的 SHA
+        return web.json_response({"ref": f"refs/heads/{branch}",
+                                  "object": {"type": "commit", "sha": _git_blob_sha(branch.encode())}})
+
+    async def create_ref(request):
+        check_auth(request)
+        raw = await request.read()
+        app["stats"].record("POST", bytes_in=len(raw))
+        branch = json.loads(raw)["ref"].removeprefix("refs/heads/")
+        if branch in app["github_branches"]:
+            return web.json_response({"message": "Reference already exists"}, status=422)
+        app["github_branches"].add(branch)
+        # 新分支从默认分支复制文件
+        for (repo, source, path), entry in list(app["github_files"].items()):
+            if source == default_branch:
+                app["github_files"][(repo, branch, path)] = dict(entry)
+        return web.json_response({"ref": f"refs/heads/{branch}"}, status=201)
+
+    app.router.add_get(GITHUB_CONTENTS_PATH, get_contents)
+    app.router.add_put(GITHUB_CONTENTS_PATH, put_contents)
+    app.router.add_get("/repos/{owner}/{repo}", get_repo)
+    app.router.add_get("/repos/{owner}/{repo}/git/ref/heads/{branch:.+}", get_ref)
+    app.router.add_post("/repos/{owner}/{repo}/git/refs", create_ref)
+
+
+def make_stub_app(kv_token=None, github_token=None, latency=0.0, rate_limit_every=0, conflict_every=0):
+    """同时提供 KV 和 GitHub 接口的替身应用"""
+    app = _new_app(latency, rate_limit_every)
+    add_kv_routes(app, kv_token)
+    add_github_routes(app, github_token, conflict_every)
+    return app
+
+
+async def start_app(app, host="127.0.0.1", port=0):
+    """在当前事件循环中启动应用，返回 (runner, base_url)"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="远程存储本地替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--token", default=None, help="要求的 Cloudflare API Token，不指定则不校验")
+    parser.add_argument("--github-token", default=None, help="要求的 GitHub Token，不指定则不校验")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求额外延迟（秒）")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="每第 N 个请求返回 429")
+    parser.add_argument("--conflict-every", type=int, default=0, help="每第 N 次 GitHub 提交返回 SHA 冲突")
+    args = parser.parse_args()
+
+    app = make_stub_app(args.token, args.github_token, args.latency, args.rate_limit_every, args.conflict_every)
+    runner, base_url = await start_app(app, args.host, args.port)
+    print(f"Cloudflare KV 替身已启动: CLOUDFLARE_API_BASE={base_url}/client/v4")
+    print(f"GitHub 替身已启动: GITHUB_API_BASE={base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass